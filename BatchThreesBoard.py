@@ -0,0 +1,319 @@
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" This is the batched Threes Board class.
+
+BatchThreesBoard plays N independent games of Threes! in lockstep with
+numpy. Every game follows the same rules as ThreesBoard, but a step moves
+all of them with a few array operations instead of a Python loop per
+game, which is what training and evaluating strategies needs.
+"""
+
+
+###########
+# Imports #
+###########
+
+from __future__ import print_function
+
+
+import numpy as np
+
+
+from ThreesBoard import MOVES
+from TileDeck import _BASE
+
+
+#######################
+# Important Constants #
+#######################
+
+
+_SIZE = 4
+_BASE_TILES = np.array(_BASE, dtype=np.int32)
+
+"""
+The decks are kept as one row of tiles per game, as laid out by
+TileDeck._create_deck: an optional bonus slot, then two shuffled copies
+of _BASE. A bonus slot, or a bonus next tile, is stored as the negative
+of the largest tile in the bonus deck, e.g. -24 for [24, 12, 6].
+"""
+
+_DECK_WIDTH = 1 + 2 * len(_BASE)
+
+
+####################
+# Helper Functions #
+####################
+
+
+def _orient(boards, move):
+    """Turn the boards so that move becomes a swipe left"""
+
+    if move == 0:
+        return boards
+    if move == 1:
+        return boards[:, :, ::-1]
+    if move == 2:
+        return boards.transpose(0, 2, 1)
+    return boards.transpose(0, 2, 1)[:, :, ::-1]
+
+
+def _unorient(boards, move):
+    """Undo _orient"""
+
+    if move == 3:
+        return boards[:, :, ::-1].transpose(0, 2, 1)
+    return _orient(boards, move)
+
+
+def _shift_left(boards):
+    """ThreesBoard._shift_left on every row of every board at once
+
+    Same loop over the cells of a row, so the rows are changed in the
+    same order and give the same result. Every tile from 3 up is a
+    multiple of 3, so a >= 3 stands in for the slower a % 3 == 0.
+    """
+
+    boards = boards.copy()
+
+    for i in range(1, _SIZE):
+        a = boards[:, :, i-1]
+        b = boards[:, :, i]
+
+        empty = a == 0
+        merge = ~empty & (((a == b) & (a >= 3)) | (a + b == 3))
+
+        merged = np.where(a == b, 2 * a, 3)
+        new_a = np.where(empty, b, np.where(merge, merged, a))
+        new_b = np.where(empty | merge, 0, b)
+
+        boards[:, :, i-1] = new_a
+        boards[:, :, i] = new_b
+
+    return boards
+
+
+def _can_move(a, b):
+    """Same as ThreesBoard._can_move, on arrays"""
+
+    return (b != 0) & ((a == 0) | (a + b == 3) | ((a == b) & (a >= 3)))
+
+
+def _get_move_masks(boards):
+    """ThreesBoard._get_move_mask for every board"""
+
+    left = _can_move(boards[:, :, :-1], boards[:, :, 1:]).any(axis=(1, 2))
+    right = _can_move(boards[:, :, 1:], boards[:, :, :-1]).any(axis=(1, 2))
+    up = _can_move(boards[:, :-1, :], boards[:, 1:, :]).any(axis=(1, 2))
+    down = _can_move(boards[:, 1:, :], boards[:, :-1, :]).any(axis=(1, 2))
+
+    return (left.astype(np.uint8) | right.astype(np.uint8) << 1 |
+            up.astype(np.uint8) << 2 | down.astype(np.uint8) << 3)
+
+
+############################
+# Batch Threes Board Class #
+############################
+
+
+class BatchThreesBoard(object):
+    """N games of Threes! on the standard 4x4 board
+
+    board       - (N, 4, 4) tiles, same values as ThreesBoard.board
+    nextTile    - (N,) next tile, negative for a bonus tile, see above
+    highestTile - (N,) highest tile on each board
+    moves       - (N,) number of moves made in each game
+    deck        - (N, 25) tiles of each game's current deck
+    deckPos     - (N,) position of the next draw in deck
+    deckLen     - (N,) number of tiles in deck, 25 when it has a bonus
+    """
+
+    def __init__(self, n, nTiles=9, seed=None):
+        """Starting N new games
+
+        seed - seed for the numpy random generator used by all the games
+        """
+
+        self.rng = np.random.RandomState(seed)
+
+        self.deck = np.zeros((n, _DECK_WIDTH), dtype=np.int32)
+        self.deckPos = np.zeros(n, dtype=np.int32)
+        self.deckLen = np.zeros(n, dtype=np.int32)
+        self._create_decks(np.arange(n), np.full(n, 3, dtype=np.int32))
+
+        # Place the starting tiles in random positions, like
+        # ThreesBoard._populate_board
+        self.board = np.zeros((n, _SIZE, _SIZE), dtype=np.int32)
+        flat = self.board.reshape(n, _SIZE * _SIZE)
+        positions = self.rng.random_sample((n, _SIZE * _SIZE)).argsort(axis=1)
+        games = np.arange(n)
+
+        for i in range(nTiles):
+            flat[games, positions[:, i]] = self._draw(games, 3)
+
+        self.nextTile = self._draw(games, 3)
+        self.highestTile = np.full(n, 3, dtype=np.int32)
+        self.moves = np.zeros(n, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.board)
+
+    def _create_decks(self, games, highest):
+        """TileDeck._create_deck for the given games
+
+        highest - highest tile of each game, for the bonus slot
+        """
+
+        m = len(games)
+
+        # Two shuffled copies of _BASE, shuffled independently
+        order = self.rng.random_sample((m, 2, len(_BASE))).argsort(axis=2)
+        tiles = _BASE_TILES[order].reshape(m, 2 * len(_BASE))
+
+        # The first bonus tile is 1/8 of the highest tile, from 48 up
+        bonus = highest >= 48
+
+        slot = np.where(bonus, -(highest // 8), 0)[:, None]
+        empty = np.zeros((m, 1), dtype=np.int32)
+
+        self.deck[games] = np.where(bonus[:, None],
+                                    np.hstack([slot, tiles]),
+                                    np.hstack([tiles, empty]))
+        self.deckLen[games] = np.where(bonus, _DECK_WIDTH, _DECK_WIDTH - 1)
+        self.deckPos[games] = 0
+
+    def _draw(self, games, highest):
+        """TileDeck.get_next_tile for the given games
+
+        A game whose deck ran out gets a new one first.
+        """
+
+        games = np.asarray(games)
+        highest = np.broadcast_to(highest, games.shape)
+        empty = self.deckPos[games] >= self.deckLen[games]
+
+        if empty.any():
+            self._create_decks(games[empty], highest[empty])
+
+        tiles = self.deck[games, self.deckPos[games]]
+        self.deckPos[games] += 1
+
+        return tiles
+
+    def _place(self, tiles):
+        """The tile that goes on the board for each next tile
+
+        A bonus next tile becomes one of the tiles of its bonus deck, with
+        the same chance for each, like random.choice in _swipe_left.
+        """
+
+        bonus = tiles < 0
+
+        if not bonus.any():
+            return tiles
+
+        largest = -tiles[bonus]
+        count = ((largest >= 6).astype(np.int32) + (largest >= 12) +
+                 (largest >= 24))
+        pick = (self.rng.random_sample(len(largest)) * count).astype(np.int32)
+
+        tiles = tiles.copy()
+        tiles[bonus] = largest >> pick
+        return tiles
+
+    def get_move_masks(self):
+        """Legal moves of every game as a 4 bit mask, see MOVES"""
+
+        return _get_move_masks(self.board)
+
+    def gameOver(self):
+        """Boolean array of the games with no legal moves left"""
+
+        return self.get_move_masks() == 0
+
+    def step(self, moves):
+        """Swipe every game in the direction given for it
+
+        moves - (N,) indices into MOVES. An illegal move, or any move
+                with a negative index, leaves that game as it is, like
+                ThreesBoard.swipe does.
+
+        Returns a boolean array of the games that changed.
+        """
+
+        moves = np.asarray(moves)
+        changed = np.zeros(len(self.board), dtype=bool)
+
+        for move in range(len(MOVES)):
+            games = np.flatnonzero(moves == move)
+
+            if not len(games):
+                continue
+
+            before = _orient(self.board[games], move)
+            after = _shift_left(before)
+            rows = (after != before).any(axis=2)
+            legal = rows.any(axis=1)
+
+            games = games[legal]
+            after = after[legal]
+            rows = rows[legal]
+
+            if not len(games):
+                continue
+
+            # Add the next tile on a random row that changed
+            keys = self.rng.random_sample(rows.shape) * rows
+            pick = keys.argmax(axis=1)
+            after[np.arange(len(games)), pick, -1] = self._place(
+                self.nextTile[games])
+
+            self.board[games] = _unorient(after, move)
+            changed[games] = True
+
+        games = np.flatnonzero(changed)
+
+        if len(games):
+            self.highestTile[games] = self.board[games].max(axis=(1, 2))
+            self.nextTile[games] = self._draw(games, self.highestTile[games])
+            self.moves[games] += 1
+
+        return changed
+
+
+if __name__ == "__main__":
+
+    # Random play test, the same as ThreesBoard but 10000 games at once
+    import time
+
+    n = 10000
+    games = BatchThreesBoard(n, seed=0)
+    start = time.time()
+
+    while True:
+        masks = games.get_move_masks()
+
+        if not masks.any():
+            break
+
+        # Pick a random legal move for each game still going
+        keys = games.rng.random_sample((n, len(MOVES)))
+        keys *= (masks[:, None] >> np.arange(len(MOVES))) & 1
+        moves = np.where(masks > 0, keys.argmax(axis=1), -1)
+
+        games.step(moves)
+
+    elapsed = time.time() - start
+
+    print("\n  Played " + str(n) + " games with a random strategy in " +
+          "{:.2f}".format(elapsed) + " seconds.")
+    print("  The highest tile obtained is " + str(games.highestTile.max()) +
+          ", after " + "{:.1f}".format(games.moves.mean()) +
+          " moves on average.")
@@ -1,9 +1,21 @@
 from __future__ import print_function
-from ThreesBoard import ThreesBoard
-from ThreesBoard import _swipe_left, _swipe_right, _swipe_up, _swipe_down
-from TileDeck import TileDeck
-from random import randint, choice
-from copy import copy
+from ThreesBoard import ThreesBoard, _MASK_MOVES
+from ThreesBitBoard import ThreesBitBoard, init_tables
+from ThreesBitBoard import _pack, _afterstate, _get_highest, _CELL_MASK
+from ThreesBitBoard import _get_move_mask
+from TileDeck import _get_draws, _tile_code, _EMPTY_STATE, _RANKS
+from TileDeck import _code_tile, _state_code, _code_state
+from TileDeck import _create_bonus_deck, _BASE
+from ThreesStrategy import Strategy
+from GameHistory import _word_array
+from ThreesSymmetry import canonical
+from multiprocessing import Pool, cpu_count
+from collections import OrderedDict
+from array import array
+import math
+import random
+import sys
+import time
 
 MOVES = {
     "left":0,
@@ -16,7 +28,9 @@ MOVES = {
     3:"down"
 }
 
-a = ThreesBoard()
+
+_timer = getattr(time, 'perf_counter', time.time)
+
 
 def draw_board(game_board):
     for row in game_board.board:
@@ -26,53 +40,660 @@ def draw_board(game_board):
     print('-'*24)
 
 
+"""
+How MonteCarloPlayer scores the end of a rollout. Each is called as
+scoring(board, moves, highest, points): the board at the end, the moves
+in the whole game, the highest tile and the game's score.
+"""
+
+
+def _score_moves(board, moves, highest, points):
+    return moves * 100
+
+
+def _score_points(board, moves, highest, points):
+    return points
+
+
+def _score_highest(board, moves, highest, points):
+    return highest
+
+
+def _score_tiles(board, moves, highest, points):
+    return sum(sum(row) for row in board)
+
+
+def _score_small_tiles(board, moves, highest, points):
+    """Moves, less a penalty for every 1 and 2 left on the board"""
+
+    small = sum(1 for row in board for tile in row if tile == 1 or tile == 2)
+    return (moves - small) * 100
+
+
+SCORINGS = {
+    "moves": _score_moves,
+    "points": _score_points,
+    "highest": _score_highest,
+    "tiles": _score_tiles,
+    "small_tiles": _score_small_tiles
+}
+
+
+def _rollouts(job):
+    """Play random games to the end, one for each (first move, seed)
+
+    Runs in a pool worker, or in the calling process with one worker.
+    Each game is a fork with its own seed, so the result does not depend
+    on which worker plays it.
+
+    Returns a list of (move index, score), in the same order as the
+    rollouts.
+    """
+
+    board, deck, next_tile, rollouts, scoring = job
+    results = []
+    game = ThreesBitBoard(board=board, deck=deck, nextTile=next_tile)
 
-while not a.gameOver():
-    next_move_scores = [0.0, 0.0, 0.0, 0.0]
-    next_move_trials = [1.0, 1.0, 1.0, 1.0]
-    test_move = None
-    possible_moves = None
-    for i in range(100):
-        b = ThreesBoard(board=a.board, deck=TileDeck(copy(a.deck.deck)), nextTile=a.nextTile, history=[])
+    for test_move, seed in rollouts:
+        b = game.fork(record=False, seed=seed)
 
-        possible_moves = b.get_valid_moves()
-        test_move = choice(possible_moves)
         b.swipe(test_move)
-        while not b.gameOver():
-            b.swipe(MOVES[randint(0, 3)])
-        # next_move_scores[MOVES[test_move]] += sum([sum(row) for row in b.board])
-        next_move_scores[MOVES[test_move]] += len(b.history) * 100
-        # next_move_scores[MOVES[test_move]] += b.highestTile
-        # next_move_scores[MOVES[test_move]] -= sum([1 if i == 1 or i == 2 else 0 for row in b.board for i in row]) * 100
-        next_move_trials[MOVES[test_move]] += 1
-        
-
-    values = []
-    for i in range(4):
-        values.append(next_move_scores[i] / next_move_trials[i])
-
-    if max(values) == 0:
-        a.swipe(choice(a.get_valid_moves()))
-    else:
+        length, highest, points, end = b.playout(with_board=True)
+
+        score = scoring(end, b.moveCount + length, highest, points)
+        results.append((MOVES[test_move], score))
+
+    return results
+
+
+class MonteCarloPlayer(Strategy):
+    """Pick moves by playing random games after each possible move
+
+    rollouts - random games played for every move
+    workers  - processes the rollouts are spread across, 1 plays them in
+               this process
+    seed     - with a seed, the player picks the same moves for the same
+               games no matter how many workers it has
+    scoring  - how a rollout is scored, a name in SCORINGS or a function
+               called the same way, defined at module level so that pool
+               workers can load it
+    """
+
+    def __init__(self, rollouts=100, workers=1, seed=None, scoring="moves"):
+        if not callable(scoring):
+            if scoring not in SCORINGS:
+                raise ValueError('scoring must be a function or one of ' +
+                                 ', '.join(sorted(SCORINGS)))
+            scoring = SCORINGS[scoring]
+
+        self.rollouts = rollouts
+        self.workers = workers
+        self.scoring = scoring
+        self.rng = random.Random(seed)
+        self.values = [0.0, 0.0, 0.0, 0.0]
+        self._pool = None
+
+        if workers > 1:
+            self._pool = Pool(workers, init_tables)
+
+    def choose(self, a):
+        """Best move for the game a, one of a.get_valid_moves()"""
+
+        next_move_scores = [0.0, 0.0, 0.0, 0.0]
+        next_move_trials = [1.0, 1.0, 1.0, 1.0]
+        possible_moves = a.get_valid_moves()
+
+        # Every move gets the same share of rollouts, and every rollout
+        # its own seed
+        rollouts = [(possible_moves[i % len(possible_moves)],
+                     self.rng.getrandbits(32))
+                    for i in range(self.rollouts)]
+
+        chunk = -(-len(rollouts) // self.workers)
+        jobs = [(a.board, a.deck, a.nextTile, rollouts[i:i + chunk],
+                 self.scoring)
+                for i in range(0, len(rollouts), chunk)]
+
+        if self._pool:
+            results = self._pool.map(_rollouts, jobs)
+        else:
+            results = [_rollouts(job) for job in jobs]
+
+        for result in results:
+            for move, score in result:
+                next_move_scores[move] += score
+                next_move_trials[move] += 1
+
+        values = []
+        for i in range(4):
+            values.append(next_move_scores[i] / next_move_trials[i])
+        self.values = values
+
+        if max(values) == 0:
+            return self.rng.choice(possible_moves)
+
         best = max(values)
         indexes = []
         for i in range(4):
             if values[i] == best:
                 indexes.append(i)
-        move = MOVES[choice(indexes)]
-        print(move, best, a.nextTile)
-        a.swipe(move)
- 
-    draw_board(a)
-
-
-print(a)
-print("\n  The next tile is :", a.nextTile, '\n')
-for row in a.board:
-    for tile in row:
-        print(str(tile).center(6), end=' ')
-    print('')
-
-print("\n  This is the end board after using an expectimax strategy.")
-print("\n  The highest tile obtained is " + str(a.highestTile) + \
-	  ", after playing " + str(len(a.history)) + " moves.")
+        return MOVES[self.rng.choice(indexes)]
+
+    def close(self):
+        """Stop the worker processes"""
+
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+# Value of a position with no moves left, below any position still going
+_GAME_OVER = -100.0
+
+
+def _key(word, tile, deck):
+    """Compact hash of everything a search node depends on"""
+
+    bonus, n1, n2, n3, rest = deck
+    return (word | _tile_code(tile) << 64 | _RANKS[bonus] << 69 |
+            n1 << 73 | n2 << 78 | n3 << 83 | rest << 88)
+
+
+def _evaluate(word):
+    """Heuristic value of a board at the search horizon: empty cells"""
+
+    return float(sum(1 for shift in range(0, 64, 4)
+                     if not (word >> shift) & _CELL_MASK))
+
+
+class TranspositionTable(object):
+    """Bounded map from node keys to (depth, value)
+
+    When full, the entry used least recently is evicted.
+    """
+
+    def __init__(self, size=1 << 20):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._table = OrderedDict()
+
+    def get(self, key, depth):
+        """Value of key if it was searched at least depth deep, or None"""
+
+        entry = self._table.pop(key, None)
+
+        if entry is None or entry[0] < depth:
+            self.misses += 1
+            if entry is not None:
+                self._table[key] = entry
+            return None
+
+        self.hits += 1
+        self._table[key] = entry
+        return entry[1]
+
+    def put(self, key, depth, value):
+        self._table.pop(key, None)
+        self._table[key] = (depth, value)
+
+        if len(self._table) > self.size:
+            self._table.popitem(last=False)
+
+    def __len__(self):
+        return len(self._table)
+
+
+class ExpectimaxPlayer(Strategy):
+    """Pick moves with a depth limited expectimax search
+
+    The player picks a move at max nodes. At chance nodes the game picks
+    the changed row that gets the next tile, which bonus tile it is, and
+    the tile drawn from what is left of the deck.
+
+    depth      - moves searched ahead
+    table_size - entries kept in the transposition table
+    cache      - AfterstateCache to share with the games, or None
+    symmetric  - key the table on canonical boards, so the 8 rotations
+                 and reflections of a node share one entry. A node's
+                 value is the same for all of them, but fewer than 1 in
+                 1000 lookups hit only this way, for the cost of canonical
+    """
+
+    def __init__(self, depth=3, table_size=1 << 20, cache=None,
+                 symmetric=False):
+        init_tables()
+        self.depth = depth
+        self.cache = cache
+        self.symmetric = symmetric
+        self._afterstate = cache.get if cache is not None else _afterstate
+        self.table = TranspositionTable(table_size)
+        self.nodes = 0
+        self.values = [0.0, 0.0, 0.0, 0.0]
+
+    def choose(self, a):
+        """Best move for the game a, one of a.get_valid_moves()"""
+
+        word = _pack(a.board)
+        deck = a.deck.state()
+
+        values = []
+        for move in range(4):
+            value = self._chance_node(word, move, a.nextTile, deck, self.depth)
+            values.append(_GAME_OVER if value is None else value)
+        self.values = values
+
+        possible_moves = a.get_valid_moves()
+        return max(possible_moves, key=lambda move: values[MOVES[move]])
+
+    def _max_node(self, word, tile, deck, depth):
+        """Value of the best move, tile is the next tile"""
+
+        self.nodes += 1
+
+        if depth == 0:
+            return _evaluate(word)
+
+        # Only values are kept, so no move has to be mapped back
+        board = canonical(word)[0] if self.symmetric else word
+        key = _key(board, tile, deck)
+        value = self.table.get(key, depth)
+        if value is not None:
+            return value
+
+        value = _GAME_OVER
+        for move in range(4):
+            chance = self._chance_node(word, move, tile, deck, depth)
+            if chance is not None and chance > value:
+                value = chance
+
+        self.table.put(key, depth, value)
+        return value
+
+    def _chance_node(self, word, move, tile, deck, depth):
+        """Expected value of a move, None if the move is not legal"""
+
+        after, cells = self._afterstate(word, move)
+        if not cells:
+            return None
+
+        tiles = tile if isinstance(tile, list) else [tile]
+
+        total = 0.0
+        for cell in cells:
+            for t in tiles:
+                new_word = after | _RANKS[t] << cell
+
+                # Highest tile only matters for a new deck
+                highest = _get_highest(new_word) if deck == _EMPTY_STATE else 3
+
+                for chance, next_tile, next_deck in _get_draws(deck, highest):
+                    total += chance * self._max_node(new_word, next_tile,
+                                                     next_deck, depth - 1)
+
+        return total / (len(cells) * len(tiles))
+
+
+def _deck_tiles(state, rng):
+    """A deck list with what is left in deck state, shuffled with rng
+
+    The search only knows how many of each tile are left, not their
+    order, so rollouts draw from a fresh shuffle of them.
+    """
+
+    bonus, n1, n2, n3, rest = state
+
+    current = [1] * n1 + [2] * n2 + [3] * n3
+    rng.shuffle(current)
+    tiles = [_create_bonus_deck(bonus * 8)] if bonus else []
+    tiles += current
+
+    if rest:
+        half = list(_BASE)
+        rng.shuffle(half)
+        tiles += half
+
+    return tiles
+
+
+class NodePool(object):
+    """Nodes of a search tree, in parallel arrays allocated up front
+
+    A node is an index into the arrays. Children are a linked list: the
+    first child of a node, then the sibling of each child. A max node is
+    a board for the player to move on, and keeps its packed board, next
+    tile code and deck code. A chance node is a move from its parent,
+    which is kept in label, and its children are the boards the move
+    can lead to.
+    """
+
+    def __init__(self, size=1 << 18):
+        self.size = size
+        self.used = 0
+        self.visits = array('l', [0]) * size
+        self.total = array('d', [0.0]) * size
+        self.child = array('l', [-1]) * size
+        self.sibling = array('l', [-1]) * size
+        self.word = _word_array([0]) * size
+        self.label = array('l', [0]) * size
+        self.deck = array('l', [0]) * size
+
+    def new(self, parent, word=0, label=0, deck=0):
+        """A new node, first in the children of parent, -1 when full"""
+
+        node = self.used
+        if node == self.size:
+            return -1
+        self.used += 1
+
+        self.visits[node] = 0
+        self.total[node] = 0.0
+        self.child[node] = -1
+        self.word[node] = word
+        self.label[node] = label
+        self.deck[node] = deck
+
+        if parent >= 0:
+            self.sibling[node] = self.child[parent]
+            self.child[parent] = node
+        else:
+            self.sibling[node] = -1
+
+        return node
+
+    def children(self, node):
+        child = self.child[node]
+        while child >= 0:
+            yield child
+            child = self.sibling[child]
+
+    def clear(self):
+        self.used = 0
+
+    def compact(self, root):
+        """Move the subtree of root to the front, dropping everything else
+
+        Returns the new index of root, which is 0.
+        """
+
+        fields = (self.visits, self.total, self.word, self.label, self.deck)
+        copies = [field[:self.used] for field in fields]
+        child = self.child[:self.used]
+        sibling = self.sibling[:self.used]
+
+        # Breadth first, so a node is always copied before its children
+        order = [root]
+        index = {root: 0}
+        for old in order:
+            node = child[old]
+            while node >= 0:
+                index[node] = len(order)
+                order.append(node)
+                node = sibling[node]
+
+        for new, old in enumerate(order):
+            for field, copy in zip(fields, copies):
+                field[new] = copy[old]
+            self.child[new] = index.get(child[old], -1)
+            self.sibling[new] = index.get(sibling[old], -1)
+
+        self.sibling[0] = -1
+        self.used = len(order)
+        return 0
+
+    def __len__(self):
+        return self.used
+
+
+class MCTSPlayer(Strategy):
+    """Pick moves with Monte Carlo tree search, for as long as allowed
+
+    Max nodes pick moves by UCT. Chance nodes sample what the game does
+    after a move: the changed row that gets the next tile, which bonus
+    tile it is, and the tile drawn from what is left of the deck, and
+    keep a child for each board that comes up. A new node is valued by
+    a random playout, and every node keeps the mean number of moves
+    played after it.
+
+    The tree lives in a NodePool. After a move, the subtree under the
+    board the game came to is kept for the next search.
+
+    deadline_ms - milliseconds to search for each move, if choose is
+                  not given one
+    iterations  - searches per move when there is no deadline
+    c           - exploration constant, scaled by the value of the node
+    pool_size   - nodes in the pool
+    seed        - seed of the player's rng, for the samples and playouts
+    """
+
+    def __init__(self, deadline_ms=100, iterations=1000, c=1.0,
+                 pool_size=1 << 18, seed=None):
+        init_tables()
+        self.deadline_ms = deadline_ms
+        self.iterations = iterations
+        self.c = c
+        self.rng = random.Random(seed)
+        self.pool = NodePool(pool_size)
+        self.values = [0.0, 0.0, 0.0, 0.0]
+        self.searches = 0
+
+        self._root = -1
+        self._move = None
+
+        # Game the playouts are played from
+        self._game = ThreesBitBoard(seed=0)
+        self._game.history = None
+        self._deck = self._game.deck
+
+    def choose(self, a, deadline_ms=None):
+        """Best move for the game a, one of a.get_valid_moves()
+
+        deadline_ms - milliseconds to search for, self.deadline_ms if
+                      None. With neither, self.iterations searches are
+                      made.
+        """
+
+        start = _timer()
+        possible_moves = a.get_valid_moves()
+        root = self._reroot(_pack(a.board), _tile_code(a.nextTile),
+                            _state_code(a.deck.state()))
+
+        if deadline_ms is None:
+            deadline_ms = self.deadline_ms
+
+        self.searches = 0
+        if len(possible_moves) > 1:
+            if deadline_ms is None:
+                for _ in range(self.iterations):
+                    self._search(root)
+            else:
+                stop = start + deadline_ms / 1000.0
+                while self.searches == 0 or _timer() < stop:
+                    self._search(root)
+
+        pool = self.pool
+        visits = [0, 0, 0, 0]
+        values = [_GAME_OVER] * 4
+        for node in pool.children(root):
+            move = pool.label[node]
+            visits[move] = pool.visits[node]
+            if visits[move]:
+                values[move] = pool.total[node] / visits[move]
+        self.values = values
+
+        move = max(possible_moves,
+                   key=lambda move: (visits[MOVES[move]], values[MOVES[move]]))
+        self._move = MOVES[move]
+        return move
+
+    def _reroot(self, word, tile, deck):
+        """Root for the board, kept from the last search when it is there"""
+
+        pool = self.pool
+        root = -1
+
+        if self._root >= 0:
+            for chance in pool.children(self._root):
+                if pool.label[chance] != self._move:
+                    continue
+                for node in pool.children(chance):
+                    if (pool.word[node] == word and
+                            pool.label[node] == tile and
+                            pool.deck[node] == deck):
+                        root = node
+                        break
+
+        if root < 0:
+            pool.clear()
+            root = pool.new(-1, word, tile, deck)
+        elif len(pool) > pool.size // 2:
+            root = pool.compact(root)
+
+        self._root = root
+        return root
+
+    def _select(self, node, mask):
+        """Chance node of the move to search from max node, new if untried"""
+
+        pool = self.pool
+        tried = 0
+        best = -1
+        best_score = None
+
+        visits = pool.visits
+        total = pool.total
+        scale = self.c * total[node] / max(visits[node], 1)
+        log_visits = math.log(max(visits[node], 1))
+
+        for child in pool.children(node):
+            tried |= 1 << pool.label[child]
+            n = visits[child]
+            score = (total[child] / n + scale * math.sqrt(log_visits / n)
+                     if n else float('inf'))
+            if best_score is None or score > best_score:
+                best, best_score = child, score
+
+        untried = mask & ~tried
+        if untried:
+            move = _MASK_MOVES[untried][0]
+            child = pool.new(node, label=move)
+            if child >= 0:
+                return child, move
+
+        if best < 0:
+            return -1, _MASK_MOVES[mask][0]
+        return best, pool.label[best]
+
+    def _search(self, root):
+        """Walk down the tree from root once, and back up the result"""
+
+        pool = self.pool
+        rng = self.rng
+        random_ = rng.random
+
+        node = root
+        word = pool.word[root]
+        code = pool.label[root]
+        deck = _code_state(pool.deck[root])
+        tile = _code_tile(code)
+
+        path = [(node, 0)]
+        depth = 0
+        leaf = False
+
+        while True:
+            mask = _get_move_mask(word)
+            if not mask:
+                result = depth
+                break
+
+            if leaf:
+                self._game._word = word
+                self._game.nextTile = tile
+                self._deck.deck = _deck_tiles(deck, rng)
+                self._game.deck = self._deck
+                result = depth + self._game.playout(rng=rng)[0]
+                break
+
+            chance, move = self._select(node, mask)
+            if chance >= 0:
+                path.append((chance, depth))
+
+            after, cells = _afterstate(word, move)
+            placed = rng.choice(tile) if isinstance(tile, list) else tile
+            word = after | _RANKS[placed] << cells[int(random_() * len(cells))]
+
+            highest = _get_highest(word) if deck == _EMPTY_STATE else 3
+            draws = _get_draws(deck, highest)
+            pick = random_()
+            for odds, tile, deck in draws:
+                pick -= odds
+                if pick < 0:
+                    break
+
+            depth += 1
+            code = _tile_code(tile)
+            deck_code = _state_code(deck)
+            node = -1
+
+            if chance >= 0:
+                for child in pool.children(chance):
+                    if (pool.word[child] == word and
+                            pool.label[child] == code and
+                            pool.deck[child] == deck_code):
+                        node = child
+                        break
+                else:
+                    node = pool.new(chance, word, code, deck_code)
+                    leaf = True
+
+            if node < 0:
+                leaf = True
+            else:
+                path.append((node, depth))
+
+        # Each node in the path is worth the moves played after it
+        visits = pool.visits
+        total = pool.total
+        for node, moves in path:
+            visits[node] += 1
+            total[node] += result - moves
+
+        self.searches += 1
+
+
+if __name__ == "__main__":
+
+    a = ThreesBoard()
+
+    # python Expectimax_AI.py [expectimax | mcts]
+    if sys.argv[1:] == ["expectimax"]:
+        player = ExpectimaxPlayer()
+    elif sys.argv[1:] == ["mcts"]:
+        player = MCTSPlayer()
+    else:
+        player = MonteCarloPlayer(workers=cpu_count())
+
+    try:
+        while not a.gameOver():
+            move = player.choose(a)
+            print(move, max(player.values), a.nextTile)
+            a.swipe(move)
+
+            draw_board(a)
+
+    finally:
+        player.close()
+
+
+    print(a)
+    print("\n  The next tile is :", a.nextTile, '\n')
+    for row in a.board:
+        for tile in row:
+            print(str(tile).center(6), end=' ')
+        print('')
+
+    print("\n  This is the end board after using an expectimax strategy.")
+    print("\n  The highest tile obtained is " + str(a.highestTile) + \
+          ", after playing " + str(len(a.history)) + " moves.")
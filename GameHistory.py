@@ -0,0 +1,241 @@
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" Game History
+
+The record of a game of Threes! kept by ThreesBoard, one entry of
+(move, board, nextTile) for every move.
+
+Entries are not kept as tuples of lists. Each part of an entry goes in
+its own compact array, and the tuples are only built again when they
+are looked at.
+"""
+
+
+###########
+# Imports #
+###########
+
+# Future imports must occur at the beginning of a file
+from __future__ import print_function
+
+
+from array import array
+
+
+from TileDeck import _TILES, _RANKS, _tile_code, _code_tile, _state_code
+
+
+#######################
+# Important Constants #
+#######################
+
+
+# Move codes, in the same order as ThreesBoard.MOVES
+_MOVE_NAMES = ('left', 'right', 'up', 'down', 'start')
+_MOVE_CODES = dict((move, code) for code, move in enumerate(_MOVE_NAMES))
+
+# Cell code of an entry that did not add a tile
+NO_CELL = 255
+
+# Deck code of an entry recorded without the state of the deck
+NO_DECK = 0xFFFFFFFF
+
+
+####################
+# Helper Functions #
+####################
+
+
+def _word_typecode():
+    """Typecode of an array of 64 bit words, or None if there is none
+
+    'Q' is not in Python 2.7, where 'L' is 64 bits on most 64 bit
+    systems but not on Windows.
+    """
+
+    for typecode in ('Q', 'L'):
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return None
+
+
+_WORD_TYPECODE = _word_typecode()
+
+
+def _word_array(words=()):
+    """Packed 4x4 boards in an array, or in a list without a 64 bit one"""
+
+    if _WORD_TYPECODE is None:
+        return list(words)
+    return array(_WORD_TYPECODE, words)
+
+
+def _pack_board(board):
+    """Pack a board of any size into an integer, 4 bits per cell
+
+    Cells are in reading order from the lowest bits, so a 4x4 board is
+    packed the same way as in ThreesBitBoard.
+    """
+
+    word = 0
+    shift = 0
+
+    for row in board:
+        for tile in row:
+            word |= _RANKS[tile] << shift
+            shift += 4
+
+    return word
+
+
+def _unpack_board(word, size):
+    """Unpack an integer from _pack_board into a list of list board"""
+
+    return [[_TILES[(word >> (4 * (size * x + y))) & 0xF]
+             for y in range(size)]
+            for x in range(size)]
+
+
+#####################
+# GameHistory Class #
+#####################
+
+
+class GameHistory(object):
+    """List like history of a game, that can be forked in constant time
+
+    Every entry is stored as a packed board, a move code, a next tile
+    code (see TileDeck._tile_code), the cell where the move added its
+    tile, x * size + y, or NO_CELL, and the state of the deck after the
+    next tile was drawn (see TileDeck._state_code), or NO_DECK.
+
+    A fork does not copy its parent's entries. It remembers how many of
+    them there were, and only adds its own after that. The parent can
+    keep on playing; entries appended later are not seen by the fork.
+    """
+
+    def __init__(self, entries=None, parent=None, size=4):
+        """Creating a history
+
+        entries: (move, board, nextTile) entries to start from
+        parent: the GameHistory this one is forked from
+        size: size of the boards, taken from the parent if there is one
+        """
+
+        self._parent = parent
+        self._base = len(parent) if parent is not None else 0
+        self.size = parent.size if parent is not None else size
+
+        # Packed 4x4 boards fit in 64 bits, larger ones need Python ints
+        self._boards = _word_array() if self.size <= 4 else []
+        self._moves = array('B')
+        self._tiles = array('B')
+        self._cells = array('B')
+        self._decks = array('I')
+
+        for entry in entries or []:
+            self.append(entry)
+
+    def append(self, entry, deck=None):
+        """Record a (move, board, nextTile) entry
+
+        deck: TileDeck.state() after nextTile was drawn, if known
+        """
+
+        move, board, next_tile = entry
+
+        if self._base + len(self._moves) == 0:
+            self.size = len(board)
+            if self.size > 4:
+                self._boards = []
+
+        self.record(move, _pack_board(board), next_tile, NO_CELL, deck)
+
+    def record(self, move, word, next_tile, cell, deck):
+        """Record an entry from its packed board, added cell and deck"""
+
+        self._boards.append(word)
+        self._moves.append(_MOVE_CODES[move])
+        self._tiles.append(_tile_code(next_tile))
+        self._cells.append(cell)
+        self._decks.append(NO_DECK if deck is None else _state_code(deck))
+
+    def codes(self, index):
+        """Entry index as stored
+
+        (move code, word, tile code, cell, deck code)
+        """
+
+        # Walk up to the history holding the entry, without recursion
+        history = self
+        while index < history._base:
+            history = history._parent
+
+        index -= history._base
+        return (history._moves[index], history._boards[index],
+                history._tiles[index], history._cells[index],
+                history._decks[index])
+
+    def fork(self):
+        """A history sharing everything recorded so far"""
+
+        # Nothing recorded here yet, so fork from the parent instead, and
+        # keep chains short however often an unplayed fork is forked
+        if not self._moves and self._parent is not None:
+            history = GameHistory(parent=self._parent)
+            history._base = self._base
+            return history
+
+        return GameHistory(parent=self)
+
+    def _entry(self, index):
+        """Build the (move, board, nextTile) tuple of an entry"""
+
+        move, word, tile = self.codes(index)[:3]
+        return (_MOVE_NAMES[move], _unpack_board(word, self.size),
+                _code_tile(tile))
+
+    def __len__(self):
+        return self._base + len(self._moves)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError('GameHistory index out of range')
+
+        return self._entry(index)
+
+    def __iter__(self):
+        # Walk up to the first ancestor, then back down, without recursion
+        chain = []
+        history = self
+        stop = len(self)
+
+        while history is not None:
+            chain.append((history, stop))
+            stop = history._base
+            history = history._parent
+
+        for history, stop in reversed(chain):
+            for i in range(history._base, stop):
+                yield history._entry(i)
+
+    def __repr__(self):
+        """Game history as a string"""
+
+        return 'GameHistory(' + str(list(self)) + ')'
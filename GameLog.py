@@ -0,0 +1,328 @@
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" Game Log
+
+Binary log of recorded games, for training on millions of moves without
+pickling lists.
+
+A log is two append-only files. The record file holds one fixed size
+record per history entry of every game, back to back. The index file,
+the same path with '.idx' added, holds one entry per game: where its
+records start, how many there are, and the seed of the game. Readers
+memory-map both, so game k is found in constant time and its records can
+be read as a numpy array without copying them.
+"""
+
+
+###########
+# Imports #
+###########
+
+# Future imports must occur at the beginning of a file
+from __future__ import print_function
+
+
+import mmap
+import numbers
+import os
+import struct
+
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+from GameHistory import _MOVE_NAMES, _unpack_board
+from ThreesBitBoard import ThreesBitBoard
+from TileDeck import _code_tile
+
+
+#######################
+# Important Constants #
+#######################
+
+
+_MAGIC = b'THREESLG'
+_INDEX_MAGIC = b'THREESIX'
+_VERSION = 1
+
+# Magic, version, then padding to 16 bytes
+_HEADER = struct.Struct('<8sI4x')
+
+# board, deck, move, next tile, added cell, padding
+_RECORD = struct.Struct('<QIBBBx')
+
+# first record, number of records, seed
+_INDEX = struct.Struct('<QQQ')
+
+# Seeds that fit in the index
+_MAX_SEED = (1 << 64) - 1
+
+"""
+The same layouts as numpy dtypes, for reading records as arrays. Field
+codes are the ones GameHistory.codes returns.
+"""
+
+if np is not None:
+    RECORD_DTYPE = np.dtype([('board', '<u8'), ('deck', '<u4'),
+                             ('move', 'u1'), ('tile', 'u1'), ('cell', 'u1'),
+                             ('pad', 'u1')])
+    INDEX_DTYPE = np.dtype([('start', '<u8'), ('count', '<u8'),
+                            ('seed', '<u8')])
+
+
+####################
+# Helper Functions #
+####################
+
+
+def _open_log(path, magic):
+    """Open a log file for appending, writing its header if it is new"""
+
+    f = open(path, 'ab')
+
+    if f.tell() == 0:
+        f.write(_HEADER.pack(magic, _VERSION))
+
+    return f
+
+
+def _trim(f, size):
+    """Cut a file from _open_log back to whole entries of size bytes
+
+    A crash while writing can leave part of an entry at the end, which
+    would put every entry written after it out of line. Returns the
+    number of entries.
+    """
+
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    entries = (end - _HEADER.size) // size
+    whole = _HEADER.size + entries * size
+
+    if whole != end:
+        f.truncate(whole)
+        f.seek(whole)
+
+    return entries
+
+
+def _map(path, magic):
+    """Memory-map a log file read only, after checking its header"""
+
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+
+        if len(header) < _HEADER.size or \
+                _HEADER.unpack(header) != (magic, _VERSION):
+            raise ValueError(path + ' is not a version ' + str(_VERSION) +
+                             ' game log')
+
+        if os.fstat(f.fileno()).st_size == _HEADER.size:
+            return None
+
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+####################
+# Game Log Classes #
+####################
+
+
+class GameLogWriter(object):
+    """Append games to a log"""
+
+    def __init__(self, path):
+        self.path = path
+        self._records = _open_log(path, _MAGIC)
+        self._index = _open_log(path + '.idx', _INDEX_MAGIC)
+        # Records are flushed before their index entry is written, so no
+        # whole index entry left by a crash points past the whole records
+        self._count = _trim(self._records, _RECORD.size)
+        _trim(self._index, _INDEX.size)
+
+    def write(self, game, seed=None):
+        """Append a finished (or not) ThreesBoard game
+
+        Only 4x4 games with a history can be logged. seed is what is
+        needed to replay the game, kept in the index; game.seed if None.
+        An unseeded game can't be replayed, so it is only logged with a
+        seed given here. Seeds are ints from 0 to 2**64 - 1, which is
+        every seed ThreesRunner and fork derive. A forked game played its
+        first moves with its parent's deck, so its own seed can't replay
+        it and it is not logged.
+        """
+
+        history = game.history
+
+        if seed is None:
+            seed = game.seed
+
+        if seed is None:
+            raise ValueError('an unseeded game can not be replayed, so it '
+                             'is only logged with a seed given to write')
+
+        if not isinstance(seed, numbers.Integral) or \
+                not 0 <= seed <= _MAX_SEED:
+            raise ValueError('seed must be an int from 0 to 2**64 - 1 to be '
+                             'logged, not ' + repr(seed))
+
+        if history is None or history.size != 4:
+            raise ValueError('only 4x4 games with a history can be logged')
+
+        if history._parent is not None:
+            raise ValueError('a forked game can not be replayed from its '
+                             'seed, so it is not logged')
+
+        records = []
+        for i in range(len(history)):
+            move, word, tile, cell, deck = history.codes(i)
+            records.append(_RECORD.pack(word, deck, move, tile, cell))
+
+        # Records first, so an index entry never points past the end
+        self._records.write(b''.join(records))
+        self._records.flush()
+        self._index.write(_INDEX.pack(self._count, len(records), seed))
+        self._index.flush()
+
+        self._count += len(records)
+
+    def close(self):
+        self._records.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GameLogReader(object):
+    """Memory-mapped, random access reader of a log
+
+    reader[k] is game k as a list of (move, board, nextTile) entries, the
+    same as its history was. records(k) is the same game as a numpy
+    array of RECORD_DTYPE, a view of the file rather than a copy.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._records = _map(path, _MAGIC)
+        self._index = _map(path + '.idx', _INDEX_MAGIC)
+
+        size = len(self._index) if self._index is not None else 0
+        self._games = max(size - _HEADER.size, 0) // _INDEX.size
+
+    def __len__(self):
+        return self._games
+
+    def entry(self, k):
+        """(first record, number of records, seed) of game k"""
+
+        if k < 0:
+            k += self._games
+
+        if not 0 <= k < self._games:
+            raise IndexError('game log index out of range')
+
+        return _INDEX.unpack_from(self._index, _HEADER.size + k * _INDEX.size)
+
+    def seed(self, k):
+        """Seed game k was logged with"""
+
+        return self.entry(k)[2]
+
+    def codes(self, k):
+        """Records of game k, as tuples of GameHistory.codes"""
+
+        start, count, _ = self.entry(k)
+        offset = _HEADER.size + start * _RECORD.size
+        codes = []
+
+        for i in range(count):
+            word, deck, move, tile, cell = _RECORD.unpack_from(
+                self._records, offset + i * _RECORD.size)
+            codes.append((move, word, tile, cell, deck))
+
+        return codes
+
+    def __getitem__(self, k):
+        return [(_MOVE_NAMES[move], _unpack_board(word, 4), _code_tile(tile))
+                for move, word, tile, _, _ in self.codes(k)]
+
+    def __iter__(self):
+        for k in range(self._games):
+            yield self[k]
+
+    def replay(self, k):
+        """Play game k again from its seed and moves
+
+        Only works for a game started as ThreesBoard(seed=seed). The
+        returned game can be checked against reader[k].
+        """
+
+        game = ThreesBitBoard(seed=self.seed(k))
+
+        for move, _, _, _, _ in self.codes(k)[1:]:
+            game.swipe(_MOVE_NAMES[move])
+
+        return game
+
+    def records(self, k=None):
+        """Records of game k, or of the whole log, as a numpy array
+
+        The array is a read only view of the memory-mapped file.
+        """
+
+        if np is None:
+            raise ImportError('numpy is needed to read records as arrays')
+
+        if k is None:
+            start = 0
+            count = ((len(self._records) - _HEADER.size) // _RECORD.size
+                     if self._records is not None else 0)
+        else:
+            start, count, _ = self.entry(k)
+
+        if not count:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+
+        return np.frombuffer(self._records, dtype=RECORD_DTYPE, count=count,
+                             offset=_HEADER.size + start * _RECORD.size)
+
+    def index(self):
+        """The whole index as a numpy array of INDEX_DTYPE, without copying"""
+
+        if np is None:
+            raise ImportError('numpy is needed to read the index as an array')
+
+        return np.frombuffer(self._index, dtype=INDEX_DTYPE,
+                             count=self._games, offset=_HEADER.size)
+
+    def close(self):
+        for mapped in (self._records, self._index):
+            if mapped is None:
+                continue
+
+            try:
+                mapped.close()
+            except BufferError:
+                # Arrays from records() still use it, and the map is freed
+                # along with them
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,3 +1,12 @@
+from __future__ import print_function
+from NN_Features import FEATURES, encode, encode_games, encode_batch
+from ThreesBoard import MOVES
+from ThreesStrategy import Strategy
+import numpy as np
+import struct
+import zipfile
+import sys
+
 ## Planning Stage
 
 ## State Representation
@@ -44,4 +53,220 @@ need to make moves that make the game last as long as possible.
 I think I should use numpy to implement my NN and training algorithms.
 
 It feels unprofitable at this point to implement my own matrix library.
-"""
\ No newline at end of file
+"""
+
+
+# Hidden layers of a new network
+HIDDEN = (256, 128)
+
+
+def _map_npz(path):
+    """Memory-map every array of an uncompressed .npz, by name
+
+    np.load ignores mmap_mode for .npz files, but np.savez stores each
+    array as a plain .npy file inside the zip, so each one can be mapped
+    where it starts in the file.
+    """
+
+    arrays = {}
+
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(path + ' is compressed, save it with '
+                                 'np.savez to memory-map it')
+
+            # The local header is 30 bytes, then the name and extra field
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+
+            if np.lib.format.read_magic(f) == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran, dtype = header
+
+            name = info.filename[:-len('.npy')]
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r',
+                                     offset=f.tell(), shape=shape,
+                                     order='F' if fortran else 'C')
+
+    return arrays
+
+
+class MLP(object):
+    """Multilayer perceptron from the features to a score for each move
+
+    Every hidden layer is a matrix multiply and a ReLU; the last layer
+    gives one score for each of MOVES. A batch of games goes through
+    each layer in one multiply.
+    """
+
+    def __init__(self, weights, biases):
+        self.weights = list(weights)
+        self.biases = list(biases)
+
+    @classmethod
+    def create(cls, hidden=HIDDEN, seed=None):
+        """A new network with random weights"""
+
+        rng = np.random.RandomState(seed)
+        sizes = (FEATURES,) + tuple(hidden) + (len(MOVES),)
+
+        weights = [(rng.standard_normal((m, n)) *
+                    np.sqrt(2.0 / m)).astype(np.float32)
+                   for m, n in zip(sizes[:-1], sizes[1:])]
+        biases = [np.zeros(n, dtype=np.float32) for n in sizes[1:]]
+
+        return cls(weights, biases)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Network saved by save, memory-mapped read only by default"""
+
+        if mmap:
+            arrays = _map_npz(path)
+        else:
+            with np.load(path) as f:
+                arrays = dict(f)
+
+        layers = len(arrays) // 2
+        return cls([arrays['W' + str(i)] for i in range(layers)],
+                   [arrays['b' + str(i)] for i in range(layers)])
+
+    def save(self, path):
+        """Save the weights uncompressed, so load can memory-map them"""
+
+        arrays = {}
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            arrays['W' + str(i)] = np.ascontiguousarray(w, dtype=np.float32)
+            arrays['b' + str(i)] = np.ascontiguousarray(b, dtype=np.float32)
+
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def forward(self, features):
+        """(N, 4) move scores for (N, FEATURES) features"""
+
+        x = features
+        last = len(self.weights) - 1
+
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            x = np.dot(x, w)
+            x += b
+            if i < last:
+                np.maximum(x, 0, out=x)
+
+        return x
+
+
+def masked_moves(scores, masks, temperature=0.0, rng=np.random):
+    """Index into MOVES of the best legal move for each row of scores
+
+    masks: legal moves of each game, see ThreesBoard.get_move_mask
+    temperature: 0 for the best move, more to sample moves by softmax
+
+    A game with no legal moves gets -1, which BatchThreesBoard.step skips.
+    """
+
+    legal = (np.asarray(masks)[:, None] >> np.arange(len(MOVES))) & 1 == 1
+    playing = legal.any(axis=1)
+    masked = np.where(legal, scores, -np.inf)
+    best = masked.argmax(axis=1)
+
+    if temperature > 0:
+        # Illegal moves are -inf before exp, so their scores can't overflow
+        top = masked.max(axis=1, keepdims=True)
+        top[~playing] = 0
+        chances = np.exp((masked - top) / temperature)
+        cumulative = chances.cumsum(axis=1)
+        draws = rng.random_sample(len(scores)) * cumulative[:, -1]
+        moves = np.minimum((cumulative <= draws[:, None]).sum(axis=1),
+                           len(MOVES) - 1)
+
+        # Rounding can leave a draw past the last legal move
+        best = np.where(legal[np.arange(len(moves)), moves], moves, best)
+
+    return np.where(playing, best, -1)
+
+
+class NNPlayer(Strategy):
+    """Pick moves with an MLP, never an illegal one
+
+    model: an MLP, or the path of one saved with MLP.save
+    temperature: 0 always plays the best move, more samples moves
+    """
+
+    def __init__(self, model=None, temperature=0.0, seed=None):
+        if model is None:
+            model = MLP.create(seed=seed)
+        elif not isinstance(model, MLP):
+            model = MLP.load(model)
+
+        self.model = model
+        self.temperature = temperature
+        self.rng = np.random.RandomState(seed)
+        self._features = np.zeros((0, FEATURES), dtype=np.float32)
+
+    def _buffer(self, n):
+        """Reused (n, FEATURES) feature buffer"""
+
+        if len(self._features) < n:
+            self._features = np.zeros((n, FEATURES), dtype=np.float32)
+        return self._features[:n]
+
+    def policy(self, features, masks):
+        """Move indices for rows of features and their legal move masks"""
+
+        return masked_moves(self.model.forward(features), masks,
+                            self.temperature, self.rng)
+
+    def choose(self, game):
+        """Best move for the game, one of game.get_valid_moves()"""
+
+        features = encode(game, self._buffer(1)[0])
+        move = self.policy(features[None, :], [game.get_move_mask()])[0]
+        return MOVES[move]
+
+    def choose_games(self, games):
+        """choose for a list of games, with one pass through the network"""
+
+        features = encode_games(games, self._buffer(len(games)))
+        masks = [game.get_move_mask() for game in games]
+        return [MOVES[move] if move >= 0 else None
+                for move in self.policy(features, masks)]
+
+    def choose_batch(self, batch):
+        """Move indices for every game of a BatchThreesBoard, for step"""
+
+        features = encode_batch(batch, self._buffer(len(batch)))
+        return self.policy(features, batch.get_move_masks())
+
+
+if __name__ == "__main__":
+
+    # Play a batch of games with an untrained network
+    # python NN_AI.py [weights.npz] [games]
+    from BatchThreesBoard import BatchThreesBoard
+    import time
+
+    player = NNPlayer(sys.argv[1] if len(sys.argv) > 1 else None, seed=0)
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    games = BatchThreesBoard(n, seed=0)
+    start = time.time()
+
+    while True:
+        moves = player.choose_batch(games)
+        if (moves < 0).all():
+            break
+        games.step(moves)
+
+    elapsed = time.time() - start
+
+    print("\n  Played " + str(n) + " games with the network in " +
+          "{:.2f}".format(elapsed) + " seconds.")
+    print("  The highest tile obtained is " + str(games.highestTile.max()) +
+          ", after " + "{:.1f}".format(games.moves.mean()) +
+          " moves on average.")
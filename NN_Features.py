@@ -0,0 +1,239 @@
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" Features for NN_AI
+
+The state representation planned in NN_AI.py, as numpy arrays: the
+board, the next tile, what is left of the deck, and whether a bonus tile
+is coming. Games, batches of games and whole GameLog files are encoded
+into rows of FEATURES numbers, written into an array given by the
+caller, so the same buffer can be used for every batch.
+
+Everything is encoded from the packed codes GameHistory and GameLog
+store (see TileDeck._tile_code and TileDeck._state_code), one block of
+rows at a time.
+"""
+
+
+###########
+# Imports #
+###########
+
+from __future__ import print_function
+
+
+import numpy as np
+
+
+from GameHistory import NO_DECK, _pack_board
+from TileDeck import _BASE, _TILES, _tile_code, _state_code
+
+
+#######################
+# Important Constants #
+#######################
+
+
+_CELLS = 16
+_RANKS = 16
+
+"""
+Layout of a row of features, all 0 or 1 apart from the deck counts:
+
+BOARD - one hot rank of every cell, cell by cell in reading order
+NEXT  - rank of the next tile, or of every tile a bonus tile can be
+DECK  - 1's, 2's and 3's left in the half of the deck being drawn from,
+        and halves left after it, 0 if the deck is not known
+BONUS - a bonus tile is waiting in the deck, and the highest tile is
+        big enough for new decks to have one
+"""
+
+BOARD = 0
+NEXT = BOARD + _CELLS * _RANKS
+DECK = NEXT + _RANKS
+BONUS = DECK + 4
+FEATURES = BONUS + 2
+
+# Rows encoded at a time, to keep the temporary arrays small
+_BLOCK = 4096
+
+_TILE_VALUES = np.array(_TILES)
+_SHIFTS = np.arange(0, 64, 4, dtype=np.uint64)
+_CELL_OFFSETS = BOARD + np.arange(_CELLS) * _RANKS
+
+# Rank of the smallest bonus tile, 6, and of 48, the smallest highest
+# tile that gives a deck a bonus tile
+_MIN_BONUS = 4
+_MIN_HIGHEST = 7
+
+
+####################
+# Helper Functions #
+####################
+
+
+def _buffer(n, out, dtype):
+    """out, checked, or a new (n, FEATURES) array of dtype"""
+
+    if out is None:
+        return np.zeros((n, FEATURES), dtype=dtype)
+
+    if out.shape != (n, FEATURES):
+        raise ValueError('out must have shape ' + str((n, FEATURES)) +
+                         ', not ' + str(out.shape))
+
+    return out
+
+
+def _encode_block(words, tiles, decks, out):
+    """Encode one block of codes into out, which it fills completely"""
+
+    n = len(words)
+    rows = np.arange(n)
+
+    out[...] = 0
+
+    ranks = ((words[:, None] >> _SHIFTS) & 15).astype(np.intp)
+    out[rows[:, None], _CELL_OFFSETS + ranks] = 1
+
+    # A bonus tile is any of its largest tile, half and a quarter of it
+    tile_ranks = (tiles & 15).astype(np.intp)
+    out[rows, NEXT + tile_ranks] = 1
+
+    bonus = (tiles & 16) != 0
+    for smaller in (1, 2):
+        extra = tile_ranks - smaller
+        pick = bonus & (extra >= _MIN_BONUS)
+        out[rows[pick], NEXT + extra[pick]] = 1
+
+    known = decks != NO_DECK
+    codes = decks[known]
+    out[known, DECK] = (codes >> 4) & 15
+    out[known, DECK + 1] = (codes >> 8) & 15
+    out[known, DECK + 2] = (codes >> 12) & 15
+    out[known, DECK + 3] = codes >> 16
+    out[known, BONUS] = (codes & 15) != 0
+
+    out[:, BONUS + 1] = ranks.max(axis=1) >= _MIN_HIGHEST
+
+
+def encode_codes(words, tiles, decks, out=None, dtype=np.float32):
+    """Encode packed boards, tile codes and deck codes
+
+    words: packed 4x4 boards, as in ThreesBitBoard
+    tiles: next tile codes, see TileDeck._tile_code
+    decks: deck codes, see TileDeck._state_code, NO_DECK if not known
+    out: (n, FEATURES) array to write into, float32 or uint8 usually
+
+    Returns out, or a new array of dtype if out is None.
+    """
+
+    words = np.asarray(words, dtype=np.uint64)
+    tiles = np.asarray(tiles, dtype=np.uint8)
+    decks = np.asarray(decks, dtype=np.uint32)
+
+    n = len(words)
+    out = _buffer(n, out, dtype)
+
+    for start in range(0, n, _BLOCK):
+        stop = min(start + _BLOCK, n)
+        _encode_block(words[start:stop], tiles[start:stop],
+                      decks[start:stop], out[start:stop])
+
+    return out
+
+
+def _word(game):
+    """Packed board of a ThreesBoard or ThreesBitBoard"""
+
+    word = getattr(game, '_word', None)
+    return word if word is not None else _pack_board(game.board)
+
+
+def encode_games(games, out=None, dtype=np.float32):
+    """Encode the current state of 4x4 games, one row each"""
+
+    n = len(games)
+    words = np.fromiter((_word(game) for game in games), np.uint64, n)
+    tiles = np.fromiter((_tile_code(game.nextTile) for game in games),
+                        np.uint8, n)
+    decks = np.fromiter((_state_code(game.deck.state()) for game in games),
+                        np.uint32, n)
+
+    return encode_codes(words, tiles, decks, out, dtype)
+
+
+def encode(game, out=None, dtype=np.float32):
+    """Encode one game, as a row of FEATURES
+
+    out: 1 dimensional array of FEATURES to write into
+    """
+
+    rows = None if out is None else out.reshape(1, FEATURES)
+    return encode_games([game], rows, dtype).reshape(FEATURES)
+
+
+def _ranks(tiles):
+    """Rank of every tile in an array of tiles"""
+
+    return np.searchsorted(_TILE_VALUES, tiles).astype(np.uint64)
+
+
+def _batch_codes(batch):
+    """Packed boards, tile codes and deck codes of a BatchThreesBoard"""
+
+    n = len(batch)
+    half = len(_BASE)
+
+    words = (_ranks(batch.board.reshape(n, _CELLS)) << _SHIFTS).sum(
+        axis=1, dtype=np.uint64)
+
+    bonus = batch.nextTile < 0
+    tiles = np.where(bonus, 16 | _ranks(-batch.nextTile),
+                     _ranks(batch.nextTile))
+
+    # Tiles of the two halves after the bonus slot, and what is left of
+    # the half being drawn from, the same way TileDeck.state counts them
+    offset = batch.deckLen - 2 * half
+    drawn = batch.deckPos - offset
+    halves = np.take_along_axis(batch.deck,
+                                offset[:, None] + np.arange(2 * half), 1)
+
+    start = np.maximum(drawn, 0)
+    stop = np.where(start < half, half, 2 * half)
+    left = ((np.arange(2 * half) >= start[:, None]) &
+            (np.arange(2 * half) < stop[:, None]))
+
+    pending = np.where(drawn < 0, _ranks(-batch.deck[:, 0]), 0)
+    decks = (pending |
+             ((halves == 1) & left).sum(axis=1).astype(np.uint64) << 4 |
+             ((halves == 2) & left).sum(axis=1).astype(np.uint64) << 8 |
+             ((halves == 3) & left).sum(axis=1).astype(np.uint64) << 12 |
+             (start < half).astype(np.uint64) << 16)
+
+    return words, tiles, decks
+
+
+def encode_batch(batch, out=None, dtype=np.float32):
+    """Encode every game of a BatchThreesBoard, one row each"""
+
+    return encode_codes(*_batch_codes(batch), out=out, dtype=dtype)
+
+
+def encode_log(reader, k=None, out=None, dtype=np.float32):
+    """Encode every entry of game k of a GameLogReader, or of the whole log
+
+    Rows are in the order of the records: the board after each move, the
+    next tile and the deck after it was drawn. The records are read from
+    the memory-mapped file, without copying them first.
+    """
+
+    records = reader.records(k)
+    return encode_codes(records['board'], records['tile'], records['deck'],
+                        out, dtype)
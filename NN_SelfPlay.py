@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" Self-play training for NN_AI
+
+Worker processes play batches of games with the current network, and
+write a sample for every move into a RingBuffer in shared memory: the
+encoded state, the legal moves, the move made, and the outcome, which is
+how many more moves the game lasted. The trainer, in the main process,
+reads the samples straight from the shared arrays, and publishes new
+weights back through SharedWeights, which the workers pick up before
+their next batch of games.
+
+    python NN_SelfPlay.py [steps] [weights.npz]
+"""
+
+
+###########
+# Imports #
+###########
+
+from __future__ import print_function
+
+
+import ctypes
+import sys
+import time
+
+
+import numpy as np
+
+
+from multiprocessing import Event, Lock, Process, RawArray, RawValue
+from multiprocessing import cpu_count
+
+
+from BatchThreesBoard import BatchThreesBoard
+from NN_AI import MLP, NNPlayer
+from NN_Features import FEATURES, encode_batch
+from ThreesBoard import MOVES
+
+
+#######################
+# Important Constants #
+#######################
+
+
+# Samples kept in the ring buffer
+CAPACITY = 1 << 18
+
+# Games each worker plays at once
+BATCH = 256
+
+# Slot sequence number of a slot that is empty or being written
+_EMPTY = -1
+
+
+########################
+# Shared Memory Arrays #
+########################
+
+
+def _view(raw, dtype, shape):
+    """numpy view of a multiprocessing RawArray, without copying it"""
+
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+class RingBuffer(object):
+    """Samples written by many processes into fixed shared arrays
+
+    Writers reserve slots under a lock, and fill them outside it. Every
+    slot has a sequence number: the number of the sample in it, or
+    _EMPTY while it is being written, so a reader can tell a finished
+    sample from one that is being written or was written over.
+
+    states   - (capacity, FEATURES) uint8 features, see NN_Features
+    masks    - legal moves of each state, see ThreesBoard.get_move_mask
+    moves    - index into MOVES of the move made
+    outcomes - moves made after this one, until the game ended
+    """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self._raw = (RawArray(ctypes.c_uint8, capacity * FEATURES),
+                     RawArray(ctypes.c_uint8, capacity),
+                     RawArray(ctypes.c_uint8, capacity),
+                     RawArray(ctypes.c_float, capacity),
+                     RawArray(ctypes.c_int64, capacity))
+        self._head = RawValue(ctypes.c_int64, 0)
+        self._lock = Lock()
+        self._map()
+        self.seqs[:] = _EMPTY
+
+    def _map(self):
+        states, masks, moves, outcomes, seqs = self._raw
+        self.states = _view(states, np.uint8, (self.capacity, FEATURES))
+        self.masks = _view(masks, np.uint8, (self.capacity,))
+        self.moves = _view(moves, np.uint8, (self.capacity,))
+        self.outcomes = _view(outcomes, np.float32, (self.capacity,))
+        self.seqs = _view(seqs, np.int64, (self.capacity,))
+
+    def __getstate__(self):
+        """Only the shared arrays go to a new process, not the views"""
+
+        return {'capacity': self.capacity, '_raw': self._raw,
+                '_head': self._head, '_lock': self._lock}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    @property
+    def written(self):
+        """Samples written so far, including the ones written over"""
+
+        return self._head.value
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def write(self, states, masks, moves, outcomes):
+        """Add samples; the oldest are written over when the ring is full"""
+
+        n = len(moves)
+        if n > self.capacity:
+            states, masks, moves, outcomes = (states[-self.capacity:],
+                                              masks[-self.capacity:],
+                                              moves[-self.capacity:],
+                                              outcomes[-self.capacity:])
+            n = self.capacity
+
+        with self._lock:
+            first = self._head.value
+            self._head.value = first + n
+
+        numbers = np.arange(first, first + n)
+        slots = numbers % self.capacity
+
+        self.seqs[slots] = _EMPTY
+        self.states[slots] = states
+        self.masks[slots] = masks
+        self.moves[slots] = moves
+        self.outcomes[slots] = outcomes
+        self.seqs[slots] = numbers
+
+    def sample(self, n, rng=np.random):
+        """n samples picked at random from the ones in the ring
+
+        Returns (states, masks, moves, outcomes), copied out of the ring
+        by indexing. Samples that were being written over are left out,
+        so fewer than n may come back.
+        """
+
+        head = self.written
+        numbers = rng.randint(max(0, head - self.capacity), head, n)
+        slots = numbers % self.capacity
+
+        before = self.seqs[slots]
+        batch = (self.states[slots], self.masks[slots], self.moves[slots],
+                 self.outcomes[slots])
+        good = (before == numbers) & (self.seqs[slots] == numbers)
+
+        return tuple(array[good] for array in batch)
+
+    def window(self, first, n):
+        """Samples first to first + n, as views of the ring, not copies
+
+        Returns a list of (states, masks, moves, outcomes), one for the
+        samples before the end of the ring and one for those after, or
+        just one if they don't wrap round. None if any of the samples is
+        not written yet, or has been written over. The views are written
+        over in turn as the ring goes round, so use them straight away.
+        """
+
+        if first < 0 or not 0 < n <= self.capacity:
+            raise ValueError('window out of the ring')
+
+        windows = []
+
+        while n:
+            start = first % self.capacity
+            count = min(n, self.capacity - start)
+            stop = start + count
+
+            numbers = np.arange(first, first + count)
+            if not (self.seqs[start:stop] == numbers).all():
+                return None
+
+            windows.append((self.states[start:stop], self.masks[start:stop],
+                            self.moves[start:stop],
+                            self.outcomes[start:stop]))
+            first += count
+            n -= count
+
+        return windows
+
+
+class SharedWeights(object):
+    """The weights of an MLP in shared memory, with a version number"""
+
+    def __init__(self, model):
+        self.shapes = [(w.shape, b.shape)
+                       for w, b in zip(model.weights, model.biases)]
+        size = sum(w.size + b.size
+                   for w, b in zip(model.weights, model.biases))
+
+        self._raw = RawArray(ctypes.c_float, size)
+        self._version = RawValue(ctypes.c_int64, 0)
+        self._lock = Lock()
+        self.publish(model)
+
+    @property
+    def version(self):
+        return self._version.value
+
+    def _arrays(self):
+        """Views of each weight and bias in the shared array"""
+
+        flat = np.frombuffer(self._raw, dtype=np.float32)
+        arrays = []
+        start = 0
+
+        for shape in (s for pair in self.shapes for s in pair):
+            size = int(np.prod(shape))
+            arrays.append(flat[start:start + size].reshape(shape))
+            start += size
+
+        return arrays
+
+    def publish(self, model):
+        """Copy the weights of model in, for the workers to fetch"""
+
+        arrays = self._arrays()
+
+        with self._lock:
+            for i, (w, b) in enumerate(zip(model.weights, model.biases)):
+                arrays[2 * i][...] = w
+                arrays[2 * i + 1][...] = b
+            self._version.value += 1
+
+    def fetch(self):
+        """(version, a copy of the published MLP)"""
+
+        with self._lock:
+            arrays = [array.copy() for array in self._arrays()]
+            version = self._version.value
+
+        return version, MLP(arrays[0::2], arrays[1::2])
+
+
+####################
+# Helper Functions #
+####################
+
+
+def play_batch(player, n, seed=None):
+    """Play n games at once to the end with player
+
+    Returns (states, masks, moves, outcomes) of every move made, as in
+    RingBuffer, with the states as uint8.
+    """
+
+    games = BatchThreesBoard(n, seed=seed)
+    features = np.zeros((n, FEATURES), dtype=np.uint8)
+    steps = []
+
+    while True:
+        masks = games.get_move_masks()
+        encode_batch(games, features)
+        moves = player.policy(features, masks)
+        playing = moves >= 0
+
+        if not playing.any():
+            break
+
+        index = np.flatnonzero(playing)
+        steps.append((index, features[index], masks[index], moves[index],
+                      games.moves[index]))
+        games.step(moves)
+
+    if not steps:
+        return (np.zeros((0, FEATURES), np.uint8), np.zeros(0, np.uint8),
+                np.zeros(0, np.uint8), np.zeros(0, np.float32))
+
+    index, states, masks, moves, made = (np.concatenate(parts)
+                                         for parts in zip(*steps))
+    outcomes = (games.moves[index] - made - 1).astype(np.float32)
+
+    return states, masks, moves.astype(np.uint8), outcomes
+
+
+def _work(ring, weights, stop, batch, temperature, seed):
+    """Worker process: play batches with the latest weights until stopped"""
+
+    rng = np.random.RandomState(seed)
+    version, model = weights.fetch()
+    player = NNPlayer(model, temperature, rng.randint(1 << 31))
+
+    while not stop.is_set():
+        if weights.version != version:
+            version, player.model = weights.fetch()
+
+        ring.write(*play_batch(player, batch, rng.randint(1 << 31)))
+
+
+def policy_gradient(model, states, masks, moves, outcomes, rate=1e-3):
+    """One REINFORCE step on model, in place
+
+    Makes moves that were followed by longer games than average more
+    likely, with the softmax over the legal moves at temperature 1.
+
+    Returns the mean of outcome - baseline times -log(chance of move).
+    """
+
+    x = states.astype(np.float32)
+    activations = [x]
+    last = len(model.weights) - 1
+
+    for i, (w, b) in enumerate(zip(model.weights, model.biases)):
+        x = np.dot(x, w) + b
+        if i < last:
+            x = np.maximum(x, 0)
+        activations.append(x)
+
+    legal = (masks[:, None] >> np.arange(len(MOVES))) & 1 == 1
+    scores = np.where(legal, x, -np.inf)
+    scores -= scores.max(axis=1, keepdims=True)
+    chances = np.exp(scores)
+    chances /= chances.sum(axis=1, keepdims=True)
+
+    n = len(moves)
+    advantage = outcomes - outcomes.mean()
+    picked = chances[np.arange(n), moves]
+    loss = float(-(advantage * np.log(picked + 1e-12)).mean())
+
+    grad = chances
+    grad[np.arange(n), moves] -= 1
+    grad *= (advantage / n)[:, None]
+
+    for i in range(last, -1, -1):
+        w = model.weights[i]
+        grad_w = np.dot(activations[i].T, grad)
+        grad_b = grad.sum(axis=0)
+
+        if i:
+            grad = np.dot(grad, w.T) * (activations[i] > 0)
+
+        model.weights[i] = w - rate * grad_w.astype(np.float32)
+        model.biases[i] = model.biases[i] - rate * grad_b.astype(np.float32)
+
+    return loss
+
+
+##################
+# SelfPlay Class #
+##################
+
+
+class SelfPlay(object):
+    """Worker processes filling a RingBuffer with games of a network
+
+    model       - MLP the workers start from
+    workers     - processes playing games
+    capacity    - samples kept in the ring buffer
+    batch       - games each worker plays at once
+    temperature - how far the workers stray from the best move
+    """
+
+    def __init__(self, model, workers=None, capacity=CAPACITY, batch=BATCH,
+                 temperature=1.0, seed=None):
+        self.ring = RingBuffer(capacity)
+        self.weights = SharedWeights(model)
+        self._stop = Event()
+        rng = np.random.RandomState(seed)
+
+        workers = workers or max(1, cpu_count() - 1)
+        self._workers = [Process(target=_work,
+                                 args=(self.ring, self.weights, self._stop,
+                                       batch, temperature,
+                                       rng.randint(1 << 31)))
+                         for _ in range(workers)]
+
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def publish(self, model):
+        """Send new weights to the workers"""
+
+        self.weights.publish(model)
+
+    def close(self):
+        """Stop the workers, after the batch each is playing"""
+
+        self._stop.set()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def evaluate(model, n=500, seed=0):
+    """Mean length of n games played with the best moves of model"""
+
+    player = NNPlayer(model, seed=seed)
+    games = BatchThreesBoard(n, seed=seed)
+
+    while True:
+        moves = player.choose_batch(games)
+        if (moves < 0).all():
+            return games.moves.mean()
+        games.step(moves)
+
+
+#################
+# Main Function #
+#################
+
+
+if __name__ == "__main__":
+
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    path = sys.argv[2] if len(sys.argv) > 2 else 'weights.npz'
+
+    model = MLP.create(seed=0)
+    print("  Mean game length before training: " +
+          "{:.1f}".format(evaluate(model)))
+
+    with SelfPlay(model, seed=0) as selfplay:
+        while len(selfplay.ring) < 10000:
+            time.sleep(0.1)
+
+        ring = selfplay.ring
+        first = 0
+
+        for step in range(1, steps + 1):
+
+            # Train on every sample in turn, skipping any written over
+            while True:
+                first = max(first, ring.written - ring.capacity)
+                windows = ring.window(first, 512)
+                if windows is not None:
+                    break
+                time.sleep(0.01)
+
+            first += 512
+            for window in windows:
+                loss = policy_gradient(model, *window)
+
+            if step % 100 == 0:
+                selfplay.publish(model)
+                print("  step " + str(step) +
+                      "  samples " + str(selfplay.ring.written) +
+                      "  loss {:.3f}".format(loss) +
+                      "  mean game length {:.1f}".format(evaluate(model)))
+
+    model.save(path)
+    print("  Weights saved to " + path)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" N-tuple network player
+
+The value of a board is the sum of a weight from each of 17 tables: one
+for every row, every column and every 2x2 square of the board. A table
+is indexed by the ranks of the tuple's four cells, which on the packed
+board are 16 bits that can be read off with a shift and a mask.
+
+Values are of afterstates, the board after a swipe and before the next
+tile is added, and are learned with TD(0): the value of an afterstate
+moves towards the score the next move gains plus the value of the next
+afterstate.
+
+    python NTuple_AI.py [games] [weights.npy]
+"""
+
+
+###########
+# Imports #
+###########
+
+from __future__ import print_function
+
+
+import sys
+
+
+import numpy as np
+
+
+from ThreesBitBoard import ThreesBitBoard, init_tables
+from ThreesBitBoard import _afterstate, _get_move_mask, _get_score
+from ThreesBitBoard import _pack, _transpose
+from ThreesBoard import MOVES, _MASK_MOVES
+from ThreesStrategy import Strategy
+
+
+#######################
+# Important Constants #
+#######################
+
+
+# Entries in each table, one for every 4 ranks
+_ENTRIES = 1 << 16
+
+# Bits of the rows on the packed board, and of the top left cell of the
+# 2x2 squares; columns are the rows of the transposed board
+_ROWS = (0, 16, 32, 48)
+_SQUARES = tuple(16 * x + 4 * y for x in range(3) for y in range(3))
+
+TUPLES = len(_ROWS) * 2 + len(_SQUARES)
+
+# Start of each table in the flat weights
+_ROW_TABLES = tuple(i * _ENTRIES for i in range(4))
+_COLUMN_TABLES = tuple((4 + i) * _ENTRIES for i in range(4))
+_SQUARE_TABLES = tuple(zip(((8 + i) * _ENTRIES for i in range(9)),
+                           _SQUARES))
+
+
+####################
+# Helper Functions #
+####################
+
+
+def _indices(words):
+    """(N, TUPLES) indices into the flat weights of packed boards"""
+
+    words = np.asarray(words, dtype=np.uint64)
+    flipped = words.copy()
+
+    # _transpose, on arrays
+    a1 = flipped & np.uint64(0xF0F00F0FF0F00F0F)
+    a2 = flipped & np.uint64(0x0000F0F00000F0F0)
+    a3 = flipped & np.uint64(0x0F0F00000F0F0000)
+    flipped = a1 | (a2 << np.uint64(12)) | (a3 >> np.uint64(12))
+    b1 = flipped & np.uint64(0xFF00FF0000FF00FF)
+    b2 = flipped & np.uint64(0x00FF00FF00000000)
+    b3 = flipped & np.uint64(0x00000000FF00FF00)
+    flipped = b1 | (b2 >> np.uint64(24)) | (b3 << np.uint64(24))
+
+    mask = np.uint64(0xFFFF)
+    byte = np.uint64(0xFF)
+    columns = []
+
+    for offset, shift in zip(_ROW_TABLES, _ROWS):
+        columns.append((words >> np.uint64(shift)) & mask | np.uint64(offset))
+
+    for offset, shift in zip(_COLUMN_TABLES, _ROWS):
+        columns.append((flipped >> np.uint64(shift)) & mask |
+                       np.uint64(offset))
+
+    for offset, shift in _SQUARE_TABLES:
+        top = (words >> np.uint64(shift)) & byte
+        bottom = (words >> np.uint64(shift + 16)) & byte
+        columns.append(top | bottom << np.uint64(8) | np.uint64(offset))
+
+    return np.stack(columns, axis=1).astype(np.intp)
+
+
+#################
+# Network Class #
+#################
+
+
+class NTupleNetwork(object):
+    """Weight tables of the n-tuple network
+
+    weights is a (TUPLES, 65536) float32 array, which can be a
+    memory-mapped .npy file. Single boards are read through a memoryview
+    of it, which gives plain Python floats, and batches through numpy.
+    """
+
+    def __init__(self, weights=None):
+        if weights is None:
+            weights = np.zeros((TUPLES, _ENTRIES), dtype=np.float32)
+
+        if weights.shape != (TUPLES, _ENTRIES):
+            raise ValueError('weights must have shape ' +
+                             str((TUPLES, _ENTRIES)))
+
+        self.weights = weights
+        self._flat = weights.reshape(-1)
+        self._table = memoryview(self._flat)
+
+    @classmethod
+    def load(cls, path, mode='r'):
+        """Network saved by save, memory-mapped
+
+        mode: 'r' to only play, 'r+' to train and change the file, or
+              None to read it all into memory
+        """
+
+        return cls(np.load(path, mmap_mode=mode))
+
+    def save(self, path):
+        np.save(path, self.weights)
+
+    def value(self, word):
+        """Value of a packed afterstate"""
+
+        table = self._table
+        flipped = _transpose(word)
+        total = 0.0
+
+        for offset, shift in zip(_ROW_TABLES, _ROWS):
+            total += table[offset | (word >> shift) & 0xFFFF]
+
+        for offset, shift in zip(_COLUMN_TABLES, _ROWS):
+            total += table[offset | (flipped >> shift) & 0xFFFF]
+
+        for offset, shift in _SQUARE_TABLES:
+            total += table[offset | (word >> shift) & 0xFF |
+                           ((word >> (shift + 16)) & 0xFF) << 8]
+
+        return total
+
+    def values(self, words):
+        """Values of an array of packed afterstates"""
+
+        return self._flat[_indices(words)].sum(axis=1)
+
+    def update(self, words, targets, rate=0.5):
+        """Move the values of words towards targets, all at once
+
+        Each of the TUPLES weights of a board takes an equal share of its
+        error. A weight used by more than one board gets every share.
+        """
+
+        indices = _indices(words)
+        errors = (np.asarray(targets, dtype=np.float32) -
+                  self._flat[indices].sum(axis=1))
+
+        np.add.at(self._flat, indices.ravel(),
+                  np.repeat(errors * (rate / TUPLES), TUPLES))
+
+        return errors
+
+    def best(self, word):
+        """(move, afterstate, reward + value) of the best move, or None
+
+        move is an index into MOVES, and the reward is the score the move
+        gains before the next tile is added.
+        """
+
+        score = _get_score(word)
+        best = None
+
+        for move in _MASK_MOVES[_get_move_mask(word)]:
+            after = _afterstate(word, move)[0]
+            value = _get_score(after) - score + self.value(after)
+
+            if best is None or value > best[2]:
+                best = (move, after, value)
+
+        return best
+
+
+class NTuplePlayer(Strategy):
+    """Pick the move with the best reward plus afterstate value
+
+    network: an NTupleNetwork, or the path of one saved with save
+    """
+
+    def __init__(self, network=None):
+        init_tables()
+
+        if network is None:
+            network = NTupleNetwork()
+        elif not isinstance(network, NTupleNetwork):
+            network = NTupleNetwork.load(network)
+
+        self.network = network
+
+    def choose(self, game):
+        word = getattr(game, '_word', None)
+        if word is None:
+            word = _pack(game.board)
+
+        return MOVES[self.network.best(word)[0]]
+
+
+def train_game(network, seed=None, rate=0.5):
+    """Play one game greedily with network, then learn from it by TD(0)
+
+    The updates for the whole game are made at once at the end.
+
+    Returns the game.
+    """
+
+    game = ThreesBitBoard(seed=seed)
+    game.history = None
+
+    afters = []
+    targets = []
+    best = network.best(game._word)
+
+    while best is not None:
+        move, after, value = best
+        game.swipe(MOVES[move])
+
+        # The target of the last afterstate is the next move's reward
+        # plus the next afterstate's value, 0 when there is no next move
+        best = network.best(game._word)
+
+        afters.append(after)
+        targets.append(best[2] if best is not None else 0.0)
+
+    if afters:
+        network.update(afters, targets, rate)
+
+    return game
+
+
+#################
+# Main Function #
+#################
+
+
+if __name__ == "__main__":
+
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    path = sys.argv[2] if len(sys.argv) > 2 else 'ntuple.npy'
+
+    init_tables()
+    network = NTupleNetwork()
+    moves = []
+    highest = []
+
+    for i in range(1, games + 1):
+        game = train_game(network, seed=i)
+        moves.append(game.moveCount)
+        highest.append(game.highestTile)
+
+        if i % 100 == 0:
+            print("  games " + str(i) +
+                  "  mean moves {:.1f}".format(np.mean(moves[-100:])) +
+                  "  highest tile " + str(max(highest[-100:])))
+
+    network.save(path)
+    print("  Weights saved to " + path)
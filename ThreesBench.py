@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" Benchmarks for the hot paths of pythrees
+
+Every benchmark runs on positions from seeded games, so two runs time
+the same work. The results are written as JSON, and can be compared
+against a saved baseline to catch regressions:
+
+    python ThreesBench.py --output baseline.json
+    python ThreesBench.py --baseline baseline.json
+
+The second run exits with status 1 if any benchmark got slower than the
+threshold allows.
+"""
+
+
+###########
+# Imports #
+###########
+
+from __future__ import print_function
+
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+
+from ThreesBoard import ThreesBoard, MOVES, _shift_left
+from ThreesBitBoard import ThreesBitBoard, _shift, init_tables
+from TileDeck import TileDeck
+from Expectimax_AI import MonteCarloPlayer, ExpectimaxPlayer, MCTSPlayer
+
+
+#######################
+# Important Constants #
+#######################
+
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+# Percentiles reported for every benchmark
+PERCENTILES = (50, 90, 99)
+
+# Slowdown of the median, relative to the baseline, that is a regression
+THRESHOLD = 0.10
+
+
+####################
+# Helper Functions #
+####################
+
+
+def _positions(rng, cls=ThreesBoard, games=20):
+    """Games stopped at random points of seeded random play
+
+    Every position still has a legal move.
+    """
+
+    positions = []
+
+    for _ in range(games):
+        game = cls(seed=rng.getrandbits(32))
+        stop = rng.randint(0, 60)
+
+        while game.moveCount < stop and not game.gameOver():
+            game.swipe(rng.choice(game.get_valid_moves()))
+
+        if not game.gameOver():
+            positions.append(game)
+
+    return positions
+
+
+def _percentile(values, p):
+    """p-th percentile of sorted values, interpolating between ranks"""
+
+    if len(values) == 1:
+        return values[0]
+
+    rank = (len(values) - 1) * p / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def _measure(bench, rng, number, repeat):
+    """Time bench, repeat samples of number operations each
+
+    bench(rng, number) does any setup and returns a function that runs
+    the operations; only that function is timed.
+    """
+
+    samples = []
+
+    for _ in range(repeat):
+        run = bench(rng, number)
+        start = _timer()
+        run()
+        samples.append((_timer() - start) / number)
+
+    samples.sort()
+    result = dict(('p' + str(p), _percentile(samples, p)) for p in PERCENTILES)
+    result['mean'] = sum(samples) / len(samples)
+    result['ops_per_s'] = 1.0 / result['mean'] if result['mean'] else 0.0
+    result['number'] = number
+    result['repeat'] = repeat
+    return result
+
+
+##############
+# Benchmarks #
+##############
+
+
+def _bench_shift_left(rng, number):
+    rows = [list(row) for game in _positions(rng, games=5)
+            for row in game.board]
+    rows = [rows[i % len(rows)] for i in range(number)]
+
+    def run():
+        for row in rows:
+            _shift_left(row)
+    return run
+
+
+def _bench_shift_packed(rng, number):
+    import ThreesBitBoard as packed
+    words = [game._word for game in _positions(rng, ThreesBitBoard, 5)]
+    words = [words[i % len(words)] for i in range(number)]
+    table = packed._LEFT
+
+    def run():
+        for word in words:
+            _shift(word, table)
+    return run
+
+
+def _swipe_bench(cls):
+    def bench(rng, number):
+        positions = _positions(rng, cls, 10)
+        games = []
+        moves = []
+
+        for i in range(number):
+            game = positions[i % len(positions)].fork()
+            games.append(game)
+            moves.append(rng.choice(game.get_valid_moves()))
+
+        def run():
+            for game, move in zip(games, moves):
+                game.swipe(move)
+        return run
+    return bench
+
+
+def _method_bench(cls, name):
+    def bench(rng, number):
+        positions = _positions(rng, cls, 10)
+        calls = [getattr(positions[i % len(positions)], name)
+                 for i in range(number)]
+
+        def run():
+            for call in calls:
+                call()
+        return run
+    return bench
+
+
+def _bench_next_tile(rng, number):
+    deck = TileDeck(rng=random.Random(rng.getrandbits(32)))
+
+    def run():
+        for _ in range(number):
+            deck.get_next_tile(96)
+    return run
+
+
+def _playout_bench(cls):
+    def bench(rng, number):
+        games = [cls(seed=rng.getrandbits(32)) for _ in range(number)]
+
+        def run():
+            for game in games:
+                moves = MOVES
+                while not game.gameOver():
+                    game.swipe(moves[game.rng.randint(0, 3)])
+        return run
+    return bench
+
+
+def _bench_playout(rng, number):
+    games = _positions(rng, ThreesBitBoard, 10)
+    games = [games[i % len(games)] for i in range(number)]
+    rngs = [random.Random(rng.getrandbits(32)) for _ in range(number)]
+
+    def run():
+        for game, playout_rng in zip(games, rngs):
+            game.playout(rng=playout_rng)
+    return run
+
+
+def _player_bench(make_player):
+    def bench(rng, number):
+        positions = _positions(rng, ThreesBoard, 10)
+        player = make_player(rng.getrandbits(32))
+        games = [positions[i % len(positions)] for i in range(number)]
+
+        def run():
+            for game in games:
+                player.choose(game)
+        return run
+    return bench
+
+
+# name, benchmark, operations per sample, samples
+BENCHMARKS = (
+    ('shift_left.row', _bench_shift_left, 2000, 30),
+    ('packed.shift_board', _bench_shift_packed, 2000, 30),
+    ('ThreesBoard.swipe', _swipe_bench(ThreesBoard), 500, 30),
+    ('ThreesBitBoard.swipe', _swipe_bench(ThreesBitBoard), 500, 30),
+    ('ThreesBoard.get_valid_moves',
+     _method_bench(ThreesBoard, 'get_valid_moves'), 1000, 30),
+    ('ThreesBoard.gameOver', _method_bench(ThreesBoard, 'gameOver'), 1000, 30),
+    ('ThreesBitBoard.get_valid_moves',
+     _method_bench(ThreesBitBoard, 'get_valid_moves'), 1000, 30),
+    ('ThreesBitBoard.gameOver',
+     _method_bench(ThreesBitBoard, 'gameOver'), 1000, 30),
+    ('TileDeck.get_next_tile', _bench_next_tile, 5000, 30),
+    ('playout.ThreesBoard', _playout_bench(ThreesBoard), 5, 20),
+    ('playout.ThreesBitBoard', _playout_bench(ThreesBitBoard), 5, 20),
+    ('ThreesBitBoard.playout', _bench_playout, 20, 20),
+    ('MonteCarloPlayer.choose[100]',
+     _player_bench(lambda seed: MonteCarloPlayer(100, seed=seed)), 1, 10),
+    ('ExpectimaxPlayer.choose[depth=2]',
+     _player_bench(lambda seed: ExpectimaxPlayer(depth=2)), 1, 10),
+    ('MCTSPlayer.choose[200]',
+     _player_bench(lambda seed: MCTSPlayer(None, 200, seed=seed)), 1, 10),
+)
+
+
+def run_benchmarks(seed=0, only=None, scale=1.0):
+    """Run the benchmarks, and return their results as a dict
+
+    only: run only the benchmarks with this in their name
+    scale: multiplies the number of samples, e.g. 0.2 for a quick run
+    """
+
+    init_tables()
+    results = {}
+
+    for name, bench, number, repeat in BENCHMARKS:
+        if only and only not in name:
+            continue
+
+        rng = random.Random(seed)
+        results[name] = _measure(bench, rng, number,
+                                 max(3, int(repeat * scale)))
+
+    return {'python': platform.python_version(),
+            'seed': seed,
+            'unit': 'seconds per operation',
+            'benchmarks': results}
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Benchmarks whose median is more than threshold slower than baseline
+
+    Returns a list of (name, baseline p50, current p50, ratio).
+    """
+
+    regressions = []
+
+    for name, result in sorted(results['benchmarks'].items()):
+        base = baseline.get('benchmarks', {}).get(name)
+
+        if not base or not base['p50']:
+            continue
+
+        ratio = result['p50'] / base['p50']
+
+        if ratio > 1 + threshold:
+            regressions.append((name, base['p50'], result['p50'], ratio))
+
+    return regressions
+
+
+#################
+# Main Function #
+#################
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', help='run benchmarks with this in the name')
+    parser.add_argument('--quick', action='store_true',
+                        help='take fewer samples')
+    parser.add_argument('--output', help='write the JSON results here')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed slowdown of the median, 0.1 is 10%%')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.seed, args.only, 0.2 if args.quick else 1.0)
+
+    for name, result in sorted(results['benchmarks'].items()):
+        print('{:34s} p50 {:11.3e}s  p99 {:11.3e}s  {:12.1f} ops/s'.format(
+            name, result['p50'], result['p99'], result['ops_per_s']),
+            file=sys.stderr)
+
+    regressions = []
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+        results['regressions'] = [
+            {'name': name, 'baseline_p50': base, 'p50': current,
+             'ratio': ratio}
+            for name, base, current, ratio in regressions]
+
+        for name, base, current, ratio in regressions:
+            print('REGRESSION {}: {:.3e}s -> {:.3e}s ({:+.0%})'.format(
+                name, base, current, ratio - 1), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,718 @@
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" This is the packed Threes Board class.
+
+The standard 4x4 board fits in a single 64-bit integer when each cell
+stores the rank of its tile in 4 bits instead of the tile itself. Swipes
+become a handful of shifts and table lookups on that integer, so moving
+does not allocate any lists.
+
+ThreesBitBoard behaves like ThreesBoard, and the list of lists board is
+still available as a view for code that wants to look at the tiles.
+"""
+
+
+###########
+# Imports #
+###########
+
+from __future__ import print_function
+
+
+import os
+import random
+import struct
+
+from array import array
+from collections import OrderedDict
+
+
+import ThreesStats
+from ThreesBoard import ThreesBoard, InvalidMoveError, _MASK_MOVES
+from TileDeck import _TILES, _RANKS
+from GameHistory import _MOVE_CODES
+
+
+##############
+# Exceptions #
+##############
+
+# Raise this error if the packed board is asked to hold anything but 4x4
+class BoardSizeError(Exception):
+    pass
+
+
+#######################
+# Important Constants #
+#######################
+
+
+_SIZE = 4
+_ROW_MASK = 0xFFFF
+_CELL_MASK = 0xF
+
+# A 1 and the high bit of every cell, for finding a rank on the board
+_ONES = 0x1111111111111111
+_HIGHS = 0x8888888888888888
+
+# Header of a saved tables file: magic, version, padding to 16 bytes
+_TABLES_MAGIC = b'THREESRT'
+_TABLES_VERSION = 1
+_TABLES_HEADER = struct.Struct('<8sI4x')
+
+# Rows checked against _shift_row_left when saved tables are loaded
+_CHECKED_ROWS = range(0, 1 << 16, 997)
+
+
+####################################
+# Helper functions for packed rows #
+####################################
+
+
+def _pack(board):
+    """Pack a 4x4 list of list board into an integer
+
+    Cell (x, y) is stored in bits 4 * (4x + y) to 4 * (4x + y) + 3, so row
+    x is the 16 bits starting at bit 16x.
+    """
+
+    word = 0
+    shift = 0
+
+    for row in board:
+        for tile in row:
+            word |= _RANKS[tile] << shift
+            shift += 4
+
+    return word
+
+
+def _unpack(word):
+    """Unpack an integer into a new 4x4 list of list board"""
+
+    return [[_TILES[(word >> (16 * x + 4 * y)) & _CELL_MASK]
+             for y in range(_SIZE)]
+            for x in range(_SIZE)]
+
+
+def _shift_row_left(ranks):
+    """Same as ThreesBoard._shift_left, but on tile ranks
+
+    Merging two tiles that are multiples of 3 is one rank up instead of
+    doubling the tile. 1 and 2 are their own ranks, so they still add up
+    to 3. Rank 15 is the largest that fits in 4 bits, so it does not
+    merge.
+    """
+
+    row = list(ranks)
+
+    for i in range(1, len(row)):
+
+        # Move tile left if the left space is empty
+        if row[i-1] == 0:
+            row[i-1], row[i] = row[i], row[i-1]
+
+        # Merge left, if the two tiles are the same, and divisible by 3
+        elif row[i-1] == row[i] and 3 <= row[i] < 15:
+            row[i-1] += 1
+            row[i] = 0
+
+        # Merge left, if two tiles adds up to 3
+        elif row[i-1] + row[i] == 3:
+            row[i-1] = 3
+            row[i] = 0
+
+    return row
+
+
+def _pack_row(ranks):
+    """Pack 4 tile ranks into a row code"""
+
+    code = 0
+
+    for y, rank in enumerate(ranks):
+        code |= rank << (4 * y)
+
+    return code
+
+
+def _row_entries(code):
+    """Swipe left and swipe right table entries of one row code
+
+    Each entry is the new row code, with bit 16 set if the row changed.
+    """
+
+    ranks = [(code >> (4 * y)) & _CELL_MASK for y in range(_SIZE)]
+
+    left = _pack_row(_shift_row_left(ranks))
+    right = _pack_row(_shift_row_left(ranks[::-1])[::-1])
+
+    return left | (left != code) << 16, right | (right != code) << 16
+
+
+def _build_tables():
+    """Swipe left and swipe right for every one of the 2**16 rows"""
+
+    left = []
+    right = []
+
+    for code in range(1 << 16):
+        left_entry, right_entry = _row_entries(code)
+        left.append(left_entry)
+        right.append(right_entry)
+
+    return left, right
+
+
+def _load_tables(path):
+    """Read the tables saved by _save_tables, None if they are unusable
+
+    Files without the header, of another version or size, or with rows
+    that don't match _shift_row_left (say from a machine of the other
+    byte order) are unusable.
+    """
+
+    left = array('I')
+    right = array('I')
+
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_TABLES_HEADER.size)
+            if len(header) != _TABLES_HEADER.size or \
+                    _TABLES_HEADER.unpack(header) != (_TABLES_MAGIC,
+                                                      _TABLES_VERSION):
+                return None
+
+            left.fromfile(f, 1 << 16)
+            right.fromfile(f, 1 << 16)
+
+            if f.read(1):
+                return None
+
+    except (IOError, OSError, EOFError):
+        return None
+
+    for code in _CHECKED_ROWS:
+        if (left[code], right[code]) != _row_entries(code):
+            return None
+
+    return list(left), list(right)
+
+
+def _save_tables(path, left, right):
+    """Write the tables to path, so other processes can skip building
+
+    They are written to a temporary file first and renamed into place,
+    so another process never loads half a file. Saving is only a cache,
+    so failing to is not an error.
+    """
+
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+
+    try:
+        with open(temp, 'wb') as f:
+            f.write(_TABLES_HEADER.pack(_TABLES_MAGIC, _TABLES_VERSION))
+            array('I', left).tofile(f)
+            array('I', right).tofile(f)
+
+        os.rename(temp, path)
+
+    except (IOError, OSError):
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+
+# Built by init_tables the first time a packed board is needed
+_LEFT = None
+_RIGHT = None
+
+
+def init_tables(path=None):
+    """Build the row tables once per process
+
+    path - file to load the tables from. If it cannot be read, or is
+           not a tables file, the tables are built and then saved there. Defaults to the
+           THREES_TABLES environment variable, and no file at all if
+           that is not set either.
+    """
+
+    global _LEFT, _RIGHT
+
+    if _LEFT is not None:
+        return
+
+    path = path or os.environ.get('THREES_TABLES')
+    tables = _load_tables(path) if path else None
+
+    if tables is None:
+        tables = _build_tables()
+
+        if path:
+            _save_tables(path, *tables)
+
+    _LEFT, _RIGHT = tables
+
+
+######################################
+# Helper functions for packed boards #
+######################################
+
+
+def _transpose(word):
+    """Reflect across the "y=x" diagonal, the packed _row2col"""
+
+    a1 = word & 0xF0F00F0FF0F00F0F
+    a2 = word & 0x0000F0F00000F0F0
+    a3 = word & 0x0F0F00000F0F0000
+    word = a1 | (a2 << 12) | (a3 >> 12)
+
+    b1 = word & 0xFF00FF0000FF00FF
+    b2 = word & 0x00FF00FF00000000
+    b3 = word & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def _shift(word, table):
+    """Shift every row with a row table, without adding the next tile
+
+    Returns the new board and a 4 bit mask of the rows that changed.
+    """
+
+    row0 = table[word & _ROW_MASK]
+    row1 = table[(word >> 16) & _ROW_MASK]
+    row2 = table[(word >> 32) & _ROW_MASK]
+    row3 = table[(word >> 48) & _ROW_MASK]
+
+    return ((row0 & _ROW_MASK) |
+            (row1 & _ROW_MASK) << 16 |
+            (row2 & _ROW_MASK) << 32 |
+            (row3 & _ROW_MASK) << 48,
+            row0 >> 16 | (row1 >> 16) << 1 |
+            (row2 >> 16) << 2 | (row3 >> 16) << 3)
+
+
+def _insert(word, changes, tile, offset, rng=random):
+    """Add the next tile on a row that changed
+
+    offset - bit of the row where the tile goes, 12 for the right end
+             after swiping left, 0 for the left end after swiping right
+
+    Same as ThreesBoard._swipe_left, including how the row is picked with
+    rng, so both boards use their random numbers the same way.
+    """
+
+    while True:
+        pick = rng.randint(0, _SIZE - 1)
+
+        if not (changes >> pick) & 1:
+            continue
+
+        if isinstance(tile, list):
+            tile = rng.choice(tile)
+
+        return word | _RANKS[tile] << (16 * pick + offset)
+
+
+def _swipe_left(word, tile=0, rng=random):
+    """Perform what happens at board level when you swipe left"""
+
+    new_word, changes = _shift(word, _LEFT)
+
+    # If the board did not change, then it's not a legal move
+    if not changes:
+        return word
+
+    return _insert(new_word, changes, tile, 12, rng)
+
+
+def _swipe_right(word, tile=0, rng=random):
+    """Perform what happens at board level when you swipe right"""
+
+    new_word, changes = _shift(word, _RIGHT)
+
+    if not changes:
+        return word
+
+    return _insert(new_word, changes, tile, 0, rng)
+
+
+def _swipe_up(word, tile=0, rng=random):
+    """Based on _swipe_left"""
+
+    return _transpose(_swipe_left(_transpose(word), tile, rng))
+
+
+def _swipe_down(word, tile=0, rng=random):
+    """Based on _swipe_right"""
+
+    return _transpose(_swipe_right(_transpose(word), tile, rng))
+
+
+def _insert_shifts(move, rows):
+    """Bits of the cells that can get the next tile after a move
+
+    rows is the mask of the rows (columns for up and down) that changed.
+    The tile goes on the far side from the swipe: the right end of a row
+    after swiping left, the bottom of a column after swiping up.
+    """
+
+    cell = (lambda i: 16 * i + 12,
+            lambda i: 16 * i,
+            lambda i: 48 + 4 * i,
+            lambda i: 4 * i)[move]
+
+    return tuple(cell(i) for i in range(_SIZE) if (rows >> i) & 1)
+
+
+# _INSERT_SHIFTS[move][rows] is _insert_shifts(move, rows)
+_INSERT_SHIFTS = tuple(tuple(_insert_shifts(move, rows) for rows in range(16))
+                       for move in range(4))
+
+
+def _afterstate(word, move):
+    """Deterministic part of a move, before the next tile is added
+
+    move is an index into ThreesBoard.MOVES. Returns the shifted board and
+    the bits of the cells where the next tile can go, one for each row
+    that changed. An illegal move has no cells.
+    """
+
+    if move >= 2:
+        after, rows = _shift(_transpose(word), _LEFT if move == 2 else _RIGHT)
+        return _transpose(after), _INSERT_SHIFTS[move][rows]
+
+    after, rows = _shift(word, _LEFT if move == 0 else _RIGHT)
+    return after, _INSERT_SHIFTS[move][rows]
+
+
+# _INSERT_ROWS[move][cell] is the row, or column for up and down, of a
+# cell from _INSERT_SHIFTS
+_INSERT_ROWS = tuple(dict((cell, i) for i in range(_SIZE)
+                          for cell in _insert_shifts(move, 1 << i))
+                     for move in range(4))
+
+
+class AfterstateCache(object):
+    """Bounded memo of _afterstate, keyed by packed board and move
+
+    Only the deterministic part of a move is kept: the shifted board and
+    the cells the next tile can go to. Where the tile goes is still
+    picked with the game's rng on every swipe.
+
+    One cache can be shared by any number of ThreesBitBoards, see
+    ThreesBitBoard.cache, and by search code calling get in place of
+    _afterstate. When full, the entry used least recently is evicted.
+    """
+
+    def __init__(self, size=1 << 16):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._table = OrderedDict()
+
+    def get(self, word, move):
+        """Same as _afterstate(word, move)"""
+
+        key = word | move << 64
+        entry = self._table.pop(key, None)
+
+        if entry is None:
+            self.misses += 1
+            entry = _afterstate(word, move)
+            if len(self._table) >= self.size:
+                self._table.popitem(last=False)
+        else:
+            self.hits += 1
+
+        self._table[key] = entry
+        return entry
+
+    def get_move_mask(self, word):
+        """Same as _get_move_mask, from the cached afterstates"""
+
+        mask = 0
+        for move in range(4):
+            if self.get(word, move)[1]:
+                mask |= 1 << move
+        return mask
+
+    def swipe(self, word, move, tile=0, rng=random):
+        """Same as _swipe_left and the others, for a move index
+
+        The row is picked like _insert, so a game plays the same with and
+        without a cache.
+        """
+
+        after, cells = self.get(word, move)
+
+        if not cells:
+            return word
+
+        rows = _INSERT_ROWS[move]
+        while True:
+            pick = rng.randint(0, _SIZE - 1)
+
+            for cell in cells:
+                if rows[cell] == pick:
+                    if isinstance(tile, list):
+                        tile = rng.choice(tile)
+                    return after | _RANKS[tile] << cell
+
+    def stats(self):
+        """(hits, misses, entries)"""
+
+        return self.hits, self.misses, len(self._table)
+
+    def clear(self):
+        self._table.clear()
+
+    def __len__(self):
+        return len(self._table)
+
+
+def _get_move_mask(word):
+    """Legal moves as a 4 bit mask, see ThreesBoard.MOVES
+
+    Only the changed bits of the row tables are needed, so no board is
+    built.
+    """
+
+    flipped = _transpose(word)
+    rows = (word & _ROW_MASK, (word >> 16) & _ROW_MASK,
+            (word >> 32) & _ROW_MASK, word >> 48)
+    cols = (flipped & _ROW_MASK, (flipped >> 16) & _ROW_MASK,
+            (flipped >> 32) & _ROW_MASK, flipped >> 48)
+
+    left = _LEFT[rows[0]] | _LEFT[rows[1]] | _LEFT[rows[2]] | _LEFT[rows[3]]
+    right = (_RIGHT[rows[0]] | _RIGHT[rows[1]] |
+             _RIGHT[rows[2]] | _RIGHT[rows[3]])
+    up = _LEFT[cols[0]] | _LEFT[cols[1]] | _LEFT[cols[2]] | _LEFT[cols[3]]
+    down = (_RIGHT[cols[0]] | _RIGHT[cols[1]] |
+            _RIGHT[cols[2]] | _RIGHT[cols[3]])
+
+    return (left >> 16 | (right >> 16) << 1 |
+            (up >> 16) << 2 | (down >> 16) << 3)
+
+
+def _get_highest(word):
+    """Return highest tile on the packed board"""
+
+    return _TILES[max((word >> shift) & _CELL_MASK
+                      for shift in range(0, 64, 4))]
+
+
+def _has_rank(word, rank):
+    """Whether any cell of the packed board has rank, without a loop"""
+
+    x = word ^ (_ONES * rank)
+    return (x - _ONES) & ~x & _HIGHS != 0
+
+
+def _get_score(word):
+    """Same as ThreesBoard._get_score, on the packed board"""
+
+    score = 0
+
+    while word:
+        rank = word & _CELL_MASK
+        if rank >= 3:
+            score += 3 ** (rank - 2)
+        word >>= 4
+
+    return score
+
+
+_SWIPES = {'left': _swipe_left,
+           'right': _swipe_right,
+           'up': _swipe_up,
+           'down': _swipe_down}
+
+
+#########################
+# Threes BitBoard Class #
+#########################
+
+
+class ThreesBitBoard(ThreesBoard):
+    """ThreesBoard for the standard 4x4 game, stored as one integer
+
+    board is a list of list view of the packed board. Changing the view
+    does not change the game; assign a whole board to it instead.
+
+    cache is an AfterstateCache that swipes and legal move checks go
+    through, or None. Set it on the class to share one cache between
+    every game, or on a game for that game and its forks.
+    """
+
+    cache = None
+
+    def __init__(
+            self,
+            size=4,  # only the standard board can be packed
+            nTiles=9,
+            board=None,
+            deck=None,
+            history=None,
+            nextTile=0,
+            seed=None,
+            rng=None):
+
+        """Same arguments as ThreesBoard"""
+
+        if size != _SIZE or (board and len(board) != _SIZE):
+            raise BoardSizeError
+
+        init_tables()
+        self._word = 0
+
+        ThreesBoard.__init__(self, size, nTiles, board, deck, history,
+                             nextTile, seed, rng)
+
+    @property
+    def board(self):
+        """List of list view of the packed board"""
+
+        return _unpack(self._word)
+
+    @board.setter
+    def board(self, board):
+        self._word = _pack(board)
+
+    def swipe(self, move):
+        """Same as ThreesBoard.swipe"""
+
+        if ThreesStats.enabled:
+            start = ThreesStats.timer()
+
+        try:
+            swipe = _SWIPES[move]
+
+        except KeyError:
+            raise InvalidMoveError
+
+        if self.cache is not None:
+            new_word = self.cache.swipe(self._word, _MOVE_CODES[move],
+                                        self.nextTile, self.rng)
+        else:
+            new_word = swipe(self._word, self.nextTile, self.rng)
+
+        changed = new_word != self._word
+
+        if changed:
+            word = self._word
+            self._word = new_word
+            self.highestTile = _get_highest(new_word)
+            self.nextTile = self.deck.get_next_tile(self.highestTile)
+            self.moveCount += 1
+
+            if self.history is not None:
+                # The only cell that differs from the shifted board
+                afterstate = (self.cache.get if self.cache is not None
+                              else _afterstate)
+                added = new_word ^ afterstate(word, _MOVE_CODES[move])[0]
+                self.history.record(move, new_word, self.nextTile,
+                                    (added.bit_length() - 1) // 4,
+                                    self.deck.state())
+
+        if ThreesStats.enabled:
+            ThreesStats.record_swipe(move, changed, start)
+
+    def playout(self, policy='random', max_moves=None, rng=None,
+                with_board=False):
+        """Same as ThreesBoard.playout, on the packed board
+
+        A policy gets the packed board in place of the list of lists.
+        """
+
+        rng = rng if rng is not None else self.rng
+        random_ = rng.random
+        word = self._word
+        tile = self.nextTile
+        deck = self.deck.fork(rng)
+        top = _RANKS[_get_highest(word)]
+        moves = 0
+
+        stats = ThreesStats.enabled
+        if stats:
+            start = ThreesStats.timer()
+            made = [0, 0, 0, 0]
+
+        if policy == 'random':
+            policy = None
+
+        while moves != max_moves:
+            mask = _get_move_mask(word)
+
+            if not mask:
+                break
+
+            if policy is None:
+                legal = _MASK_MOVES[mask]
+                move = legal[int(random_() * len(legal))]
+            else:
+                move = policy(word, mask, rng)
+
+            after, cells = _afterstate(word, move)
+
+            if isinstance(tile, list):
+                tile = rng.choice(tile)
+
+            rank = _RANKS[tile]
+            word = after | rank << cells[int(random_() * len(cells))]
+
+            # A move can only make the highest rank one higher by merging,
+            # or bring a higher one with the new tile
+            if rank > top:
+                top = rank
+            if top < 15 and _has_rank(word, top + 1):
+                top += 1
+
+            tile = deck.get_next_tile(_TILES[top])
+            moves += 1
+
+            if stats:
+                made[move] += 1
+
+        if stats:
+            ThreesStats.record_playout(made, start)
+
+        if with_board:
+            return moves, _TILES[top], _get_score(word), _unpack(word)
+        return moves, _TILES[top], _get_score(word)
+
+    def get_move_mask(self):
+        """Same as ThreesBoard.get_move_mask, from the row tables"""
+
+        if self.cache is not None:
+            return self.cache.get_move_mask(self._word)
+
+        return _get_move_mask(self._word)
+
+
+if __name__ == "__main__":
+
+    # Same random play test as ThreesBoard, on the packed board
+    from random import choice
+
+    a = ThreesBitBoard()
+
+    while not a.gameOver():
+        a.swipe(choice(['up', 'left', 'down', 'right']))
+
+    print("\n  The next tile is :", a.nextTile, '\n')
+    for row in a.board:
+        for tile in row:
+            print(str(tile).center(6), end = ' ')
+        print('')
+
+    print("\n  The highest tile obtained is " + str(a.highestTile) + \
+          ", after playing " + str(len(a.history)) + " moves.")
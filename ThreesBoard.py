@@ -25,7 +25,9 @@ import random
 import copy
 
 
-from TileDeck import TileDeck
+import ThreesStats
+from TileDeck import TileDeck, _derive_seed
+from GameHistory import GameHistory, NO_CELL, _pack_board
 
 
 ##############
@@ -48,6 +50,19 @@ class InvalidMoveError:
     pass
 
 
+#######################
+# Important Constants #
+#######################
+
+
+# Bit i of a move mask is set when MOVES[i] is a legal move
+MOVES = ('left', 'right', 'up', 'down')
+
+# _MASK_MOVES[mask] are the indices into MOVES of the moves in mask
+_MASK_MOVES = tuple(tuple(i for i in range(4) if (mask >> i) & 1)
+                    for mask in range(16))
+
+
 ###########################################
 # Helper functions for creating the board #
 ###########################################
@@ -62,12 +77,13 @@ def _create_board(size=4):
     return [[0 for j in range(size)] for i in range(size)]
 
 # Should add in the comments why the deck is returned as well.
-def _populate_board(board, deck, nTiles):
+def _populate_board(board, deck, nTiles, rng=random):
     """Put the starting tiles on the board
 
     board - a list of list filled with 0's a la above function
     deck - Threes! does not use random decks, see TileDeck.py
     nTiles - determines how many tiles are used to populate board
+    rng - random.Random that places the tiles, or the random module
 
     Remaining tiles are returned to be used in the game.
     """
@@ -82,7 +98,7 @@ def _populate_board(board, deck, nTiles):
         raise TooManyTilesError
 
     positions = [(x, y) for x in range(size) for y in range(size)]
-    random.shuffle(positions)
+    rng.shuffle(positions)
 
     for i in range(nTiles):
         tile = deck.get_next_tile()
@@ -128,11 +144,12 @@ def _shift_left(row):
     return row_copy, 0 if row == row_copy else 1
 
 
-def _swipe_left(board, tile=0):
+def _swipe_left(board, tile=0, rng=random):
     """Perform what happens at board level when you swipe left
 
     Adds the next tile
     Add no tile by default; tile=0, which is the empty tile
+    rng picks the row for the tile, and the tile from a bonus deck
     """
 
     size = len(board)
@@ -152,48 +169,57 @@ def _swipe_left(board, tile=0):
     else:
         # Add next tile on a row that changed
         while True:
-            pick = random.randint(0, size - 1)
+            pick = rng.randint(0, size - 1)
 
             if changes[pick] == 0:
                 continue
 
             else:
-                new_board[pick][-1] = tile if not bonus else random.choice(tile)
+                new_board[pick][-1] = tile if not bonus else rng.choice(tile)
                 return new_board
 
 
-def _swipe_right(board, tile=0):
+def _swipe_right(board, tile=0, rng=random):
     """Perform what happens at board level when you swipe right
 
     Based on _swipe_left
     """
 
-    return _reverse(_swipe_left(_reverse(board), tile))
+    return _reverse(_swipe_left(_reverse(board), tile, rng))
 
 
-def _swipe_up(board, tile=0):
+def _swipe_up(board, tile=0, rng=random):
     """Perform what happens at board level when you swipe up
 
     Based on _swipe_left
     """
 
-    return _row2col(_swipe_left(_row2col(board), tile))
+    return _row2col(_swipe_left(_row2col(board), tile, rng))
 
 
-def _swipe_down(board, tile=0):
+def _swipe_down(board, tile=0, rng=random):
     """Perform what happens at board level when you swipe down
 
     Based on _swipe_left
     """
 
-    return _row2col(_swipe_right(_row2col(board), tile))
+    return _row2col(_swipe_right(_row2col(board), tile, rng))
+
+
+def _deepcopy(board):
+    """copy.deepcopy, counted by ThreesStats"""
+
+    if ThreesStats.enabled:
+        ThreesStats.count('deepcopy')
+
+    return copy.deepcopy(board)
 
 
 # I should move _reverse and _row2col below _swipe_left
 def _reverse(board):
     """Reverse the board right and left"""
 
-    new_board = copy.deepcopy(board)
+    new_board = _deepcopy(board)
 
     for row in new_board:
         row.reverse()
@@ -205,7 +231,7 @@ def _row2col(board):
     """Reflect across the "y=x" diagonal"""
 
     size = len(board)
-    new_board = copy.deepcopy(board)
+    new_board = _deepcopy(board)
 
     for x in range(size):
         for y in range(x):
@@ -214,6 +240,51 @@ def _row2col(board):
     return new_board
 
 
+##########################################
+# Helper functions for checking legality #
+##########################################
+
+
+def _can_move(a, b):
+    """Whether tile b can move into the space of its neighbour a
+
+    Same rules as _shift_left: b slides into an empty space, or merges
+    with a when they add up to 3 or are equal multiples of 3.
+    """
+
+    return b != 0 and (a == 0 or a + b == 3 or (a == b and a % 3 == 0))
+
+
+def _get_move_mask(board):
+    """Legal moves as a 4 bit mask, see MOVES
+
+    A row changes when swiped left exactly when one of its tiles can move
+    into its left neighbour, so checking adjacent pairs is enough. No
+    copies are made and no random numbers are drawn.
+    """
+
+    size = len(board)
+    mask = 0
+
+    for x in range(size):
+        row = board[x]
+
+        for y in range(1, size):
+            if _can_move(row[y-1], row[y]):
+                mask |= 1
+            if _can_move(row[y], row[y-1]):
+                mask |= 2
+            if _can_move(board[y-1][x], board[y][x]):
+                mask |= 4
+            if _can_move(board[y][x], board[y-1][x]):
+                mask |= 8
+
+        if mask == 15:
+            break
+
+    return mask
+
+
 ########################
 # Helper Function MISC #
 ########################
@@ -228,6 +299,50 @@ def _get_highest(board):
     return max(val for row in board for val in row)
 
 
+def _get_score(board):
+    """Score of the board as Threes! counts it
+
+    Every tile from 3 up is worth 3 to the power of how many times it
+    was doubled from 3, plus one. 1's and 2's are worth nothing.
+    """
+
+    score = 0
+
+    for row in board:
+        for tile in row:
+            if tile >= 3:
+                score += 3 ** ((tile // 3).bit_length())
+
+    return score
+
+
+def _find_added(old, new, move):
+    """Cell x * size + y where a swipe from old to new added a tile
+
+    Every row the swipe changed ends in an empty space, apart from the
+    one the next tile went on. For up and down, read column for row.
+    """
+
+    size = len(new)
+    last = size - 1
+
+    for i in range(size):
+        if move == 'left':
+            x, y = i, last
+            changed = old[i] != new[i]
+        elif move == 'right':
+            x, y = i, 0
+            changed = old[i] != new[i]
+        else:
+            x, y = (last, i) if move == 'up' else (0, i)
+            changed = any(old[j][i] != new[j][i] for j in range(size))
+
+        if changed and new[x][y] != 0:
+            return x * size + y
+
+    return NO_CELL
+
+
 ######################
 # Threes Board Class #
 ######################
@@ -246,15 +361,29 @@ class ThreesBoard(object):
             nTiles=9,  # standard Threes number of starting tiles
             board=None,  # None or previous board
             deck=None,  # None, or previous deck
-            history=None,  # None, or previous history
-            nextTile=0):  # no tile, or previous tile
+            history=None,  # None (no record kept), or previous history
+            nextTile=0,  # no tile, or previous tile
+            seed=None,  # None, or seed for a game of its own
+            rng=None):  # None (the random module), or random.Random
 
         """Creating the Threes board
 
         If passing in an old board position, that game will be recreated
         The tile deck will can also be recreated
+        A recreated game without a history does not keep one
+
+        A game with a seed, or its own rng, does not touch the random
+        module. A new game and its deck share the rng, so the seed and
+        the moves made are enough to play the same game again.
         """
 
+        if seed is not None:
+            rng = random.Random(seed)
+
+        self.seed = seed
+        self.rng = rng if rng is not None else random
+        self._forks = 0
+
         if board:
             """To consider: store all information in history
                             eliminate the need for old boards, decks ...
@@ -270,6 +399,10 @@ class ThreesBoard(object):
             self.deck = deck # Need to check whether this is None
             self.history = history
             self.highestTile = _get_highest(self.board)
+            self.moveCount = len(history) - 1 if history else 0
+
+            if isinstance(history, list):
+                self.history = GameHistory(history)
 
             # If old game information was incomplete
             if nextTile == 0:
@@ -281,21 +414,24 @@ class ThreesBoard(object):
         else:
             # Starting a new game; ignore previous history ... etc
             self.board = _create_board(size)
-            self.deck = TileDeck()
+            self.deck = TileDeck(rng=self.rng)
 
             # Populating a new board with start up tiles
             self.board, self.deck = _populate_board(self.board,
                                                    self.deck,
-                                                   nTiles)
+                                                   nTiles,
+                                                   self.rng)
 
             self.nextTile = self.deck.get_next_tile()
 
             # Set up empty history, then set initial condition
-            self.history = []
+            self.history = GameHistory()
 
             # history formate is: move, resulting board, next tile)
-            self.history.append(('start', self.board, self.nextTile))
+            self.history.append(('start', self.board, self.nextTile),
+                                self.deck.state())
             self.highestTile = 3
+            self.moveCount = 0
 
     def swipe(self, move):
         """Same function for different swipes
@@ -308,37 +444,168 @@ class ThreesBoard(object):
                      'up': _swipe_up,
                      'down': _swipe_down}
 
-        copy_board = copy.deepcopy(self.board)
+        if ThreesStats.enabled:
+            start = ThreesStats.timer()
+
+        copy_board = _deepcopy(self.board)
 
         try:
-            copy_board = direction[move](copy_board, self.nextTile)
+            copy_board = direction[move](copy_board, self.nextTile, self.rng)
 
         except KeyError:
             raise InvalidMoveError
 
-        if self.board != copy_board:
+        changed = self.board != copy_board
+
+        if changed:
+            old_board = self.board
             self.board = copy_board
             self.highestTile = _get_highest(self.board)
             self.nextTile = self.deck.get_next_tile(self.highestTile)
-            self.history.append((move, self.board, self.nextTile))
+            self.moveCount += 1
+
+            if self.history is not None:
+                self.history.record(move, _pack_board(copy_board),
+                                    self.nextTile,
+                                    _find_added(old_board, copy_board, move),
+                                    self.deck.state())
+
+        if ThreesStats.enabled:
+            ThreesStats.record_swipe(move, changed, start)
+
+    def playout(self, policy='random', max_moves=None, rng=None,
+                with_board=False):
+        """Play on from here to the end of the game, without changing it
+
+        Only legal moves are made, and no history is kept, so this is the
+        loop to use for Monte Carlo rollouts. The deck is forked.
+
+        policy: 'random' for a random legal move, or policy(board, mask,
+                rng), which returns an index into MOVES of a move in mask
+        max_moves: stop after this many moves, even if not game over
+        rng: random.Random for the moves, tiles and new decks, the
+             game's own rng if None
+        with_board: also return the board at the end, as a list of lists
+
+        Returns (moves made, highest tile, score) at the end, and the
+        board after them if with_board.
+        """
+
+        rng = rng if rng is not None else self.rng
+        swipes = (_swipe_left, _swipe_right, _swipe_up, _swipe_down)
+        board = self.board
+        tile = self.nextTile
+        deck = self.deck.fork(rng)
+        moves = 0
+
+        stats = ThreesStats.enabled
+        if stats:
+            start = ThreesStats.timer()
+            made = [0, 0, 0, 0]
+
+        if policy == 'random':
+            policy = None
+
+        while moves != max_moves:
+            mask = _get_move_mask(board)
+
+            if not mask:
+                break
+
+            if policy is None:
+                legal = _MASK_MOVES[mask]
+                move = legal[int(rng.random() * len(legal))]
+            else:
+                move = policy(board, mask, rng)
+
+            board = swipes[move](board, tile, rng)
+            tile = deck.get_next_tile(_get_highest(board))
+            moves += 1
+
+            if stats:
+                made[move] += 1
+
+        if stats:
+            ThreesStats.record_playout(made, start)
+
+        if with_board:
+            return moves, _get_highest(board), _get_score(board), board
+        return moves, _get_highest(board), _get_score(board)
+
+    def fork(self, record=True, seed=None):
+        """An independent copy of the game, made in constant time
+
+        Swipes replace the board instead of changing it, so the copy
+        shares the board until one of the games moves. The deck is
+        forked, and so is the history: the copy shares the moves made so
+        far and records its own after them.
+
+        record: False for a simulation that keeps no history at all
+        seed: seed for the copy's rng. If None, a seeded game derives one
+              from its own seed and how many forks it made, so forking
+              does not change its own random numbers. A game using the
+              random module shares it with its copies.
+        """
+
+        game = self.__class__.__new__(self.__class__)
+        game.__dict__.update(self.__dict__)
+
+        if seed is None and self.rng is not random:
+            if self.seed is not None:
+                seed = _derive_seed(self.seed, self._forks)
+            else:
+                seed = self.rng.getrandbits(64)
+            self._forks += 1
+
+        if seed is not None:
+            game.seed = seed
+            game.rng = random.Random(seed)
+            game._forks = 0
+
+        game.deck = self.deck.fork(game.rng)
+
+        if record and self.history is not None:
+            game.history = self.history.fork()
+        else:
+            game.history = None
+
+        return game
+
+    def get_move_mask(self):
+        """Legal moves as a 4 bit mask, bit i is set if MOVES[i] is legal
+
+        Checking legality does not change the board or use up random
+        numbers.
+        """
+
+        return _get_move_mask(self.board)
 
     def get_valid_moves(self):
-        new_board = copy.deepcopy(self.board)
-        moves = []
-        if _swipe_left(new_board) != self.board:
-            moves.append("left")
-        if _swipe_right(new_board) != self.board:
-            moves.append("right")
-        if _swipe_up(new_board) != self.board:
-            moves.append("up")
-        if _swipe_down(new_board) != self.board:
-            moves.append("down")
-        return moves
+        if ThreesStats.enabled:
+            mask = ThreesStats.timed_move_mask(self)
+        else:
+            mask = self.get_move_mask()
+
+        return [move for i, move in enumerate(MOVES) if (mask >> i) & 1]
 
     def gameOver(self):
-        new_board = copy.deepcopy(self.board)
+        if ThreesStats.enabled:
+            return ThreesStats.timed_move_mask(self) == 0
+
+        return self.get_move_mask() == 0
+
+    def __getstate__(self):
+        """The random module can't be pickled, so it is left out"""
+
+        state = self.__dict__.copy()
+        if state['rng'] is random:
+            state['rng'] = None
+        return state
 
-        return True if len(self.get_valid_moves()) == 0 else False
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.rng is None:
+            self.rng = random
 
     def __eq__(self, other):
 		# Consider add a check to history
@@ -16,6 +16,13 @@ Graphically see how Threes! work through curses on the command line.
 
 This is implemented as a functional test for ThreesBoard. It can also be
 used to see how an AI player is playing Threes!
+
+    python ThreesGame.py
+    python ThreesGame.py --watch expectimax --fps 10
+
+Only the cells that changed since the last frame are drawn. When
+watching, frames are skipped to keep to --fps, so the player is not
+slowed down by drawing.
 """
 
 
@@ -24,9 +31,12 @@ used to see how an AI player is playing Threes!
 ###########
 
 
+import argparse
 import curses
+import time
 from curses import KEY_LEFT, KEY_RIGHT, KEY_UP, KEY_DOWN
 from ThreesBoard import ThreesBoard
+from ThreesBitBoard import ThreesBitBoard
 
 
 ##############
@@ -90,8 +100,8 @@ def _tell_user(screen, s, color_pair=0):
     screen.addstr(3, 2, '{:^27s}'.format(str(s)), curses.color_pair(color_pair))
 
 
-def _draw_board(screen, board):
-	# Consider define color pairings elsewhere
+def _init_colors():
+    """Color pairs of the tiles, set up once before the first frame"""
 
     # Color for 1 tiles
     curses.init_pair(1, curses.COLOR_WHITE, curses.COLOR_BLUE)
@@ -102,90 +112,94 @@ def _draw_board(screen, board):
     # Color for all other tiles
     curses.init_pair(3, curses.COLOR_BLACK, curses.COLOR_WHITE)
 
-    first_y = 7
-    first_x = 2
-    offset_y = 0
-    offset_x = 0
 
-    # Consider capture draw cell in a function during refactoring
-    for row in board:
-        for cell in row:
+def _color_pair(tile):
+    """Color pair number of a tile, 0 for an empty cell"""
+
+    if tile == 0:
+        return 0
+    elif tile == 1:
+        return 1
+    elif tile == 2:
+        return 2
+    return 3
+
+
+def _draw_cell(screen, x, y, cell):
+    """Draw the 3 lines of the cell in row x, column y"""
 
-            if cell == 0:
-                cell = ' '
+    first_y = 7 + 4 * x
+    first_x = 2 + 7 * y
+    color = curses.color_pair(_color_pair(cell))
 
-                screen.addstr(first_y + offset_y - 1,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str('')),
-                              curses.color_pair(0))
+    screen.addstr(first_y - 1, first_x, ' ' * 6, color)
+    screen.addstr(first_y, first_x,
+                  '{:^6s}'.format(str(cell) if cell else ''), color)
+    screen.addstr(first_y + 1, first_x, ' ' * 6, color)
 
 
-                screen.addstr(first_y + offset_y,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str(cell)),
-                              curses.color_pair(0))
+def _draw_board(screen, board, previous=None):
+    """Draw the cells of board that differ from previous
 
-                screen.addstr(first_y + offset_y + 1,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str('')),
-                              curses.color_pair(0))
+    previous is the board returned by the last call, or None to draw
+    every cell. Returns a copy of board to pass in next time.
+    """
 
+    for x, row in enumerate(board):
+        for y, cell in enumerate(row):
+            if previous is None or previous[x][y] != cell:
+                _draw_cell(screen, x, y, cell)
 
-            elif cell == 1:
+    return [list(row) for row in board]
 
-                screen.addstr(first_y + offset_y - 1,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str('')),
-                              curses.color_pair(1))
 
-                screen.addstr(first_y + offset_y,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str(cell)),
-                              curses.color_pair(1))
+def _tell_next_tile(screen, next_tile):
 
-                screen.addstr(first_y + offset_y + 1,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str('')),
-                              curses.color_pair(1))
+    if isinstance(next_tile, list):
+        tiles = [str(t) for t in next_tile]
+        _tell_user(screen, "    ".join(tiles), _color_pair(next_tile[0]))
+
+    else:
+        _tell_user(screen, str(next_tile), _color_pair(next_tile))
 
-            elif cell == 2:
 
-                screen.addstr(first_y + offset_y - 1,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str('')),
-                              curses.color_pair(2))
+def _spectate(screen, game, player, fps):
+    """Play game with player, drawing at most fps frames a second
 
-                screen.addstr(first_y + offset_y,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str(cell)),
-                              curses.color_pair(2))
+    Moves made between two frames are not drawn, so the player goes as
+    fast as it can. fps of 0 or None draws every move. Returns False if
+    the user quit with 'q'.
+    """
 
-                screen.addstr(first_y + offset_y + 1,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str('')),
-                              curses.color_pair(2))
+    screen.nodelay(1)  # Check for 'q' without waiting
+    q_keys = [ord('q'), ord('Q')]
+    interval = 1.0 / fps if fps else 0.0
 
-            else:
+    drawn = None
+    next_frame = 0.0
 
-                screen.addstr(first_y + offset_y - 1,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str('')),
-                              curses.color_pair(3))
+    try:
+        while not game.gameOver():
+            game.swipe(player.choose(game))
 
-                screen.addstr(first_y + offset_y,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str(cell)),
-                              curses.color_pair(3))
+            now = time.time()
+            if now < next_frame:
+                continue  # Skip this frame
+            next_frame = now + interval
 
-                screen.addstr(first_y + offset_y + 1,
-                              first_x + offset_x,
-                              '{:^6s}'.format(str('')),
-                              curses.color_pair(3))
+            drawn = _draw_board(screen, game.board, drawn)
+            _tell_next_tile(screen, game.nextTile)
+            screen.refresh()
 
-            offset_x += 7
+            if screen.getch() in q_keys:
+                return False
 
-        offset_x = 0
-        offset_y += 4
+    finally:
+        player.close()
+        screen.nodelay(0)
+
+    _draw_board(screen, game.board, drawn)
+    return True
 
 
 #################
@@ -193,14 +207,18 @@ def _draw_board(screen, board):
 #################
 
 
-def main(screen):
+def main(screen, player=None, fps=30):
 
 # I could have organized this function so much better
 # I could also have structured my code so much better
 
+    # player is a Strategy to watch play instead of the keyboard, drawn
+    # at fps frames a second at most, see _spectate
+
     # Set up environment:
 
     curses.curs_set(0)  # Hide Cursor, not needed in this game
+    _init_colors()
 
     # Find out more about environment
     y, x = screen.getmaxyx()
@@ -246,27 +264,29 @@ def main(screen):
     screen.keypad(1)  # Enable special keys
     good_keys = [KEY_LEFT, KEY_RIGHT, KEY_UP, KEY_DOWN] # Only get these
     q_keys = [ord('q'), ord('Q')] # quit using 'q' or 'Q'
-    game = ThreesBoard()  # Make a new board
 
-    # Game Loop
-    while not game.gameOver():
+    if player is not None:
+
+        # The packed board plays faster, and no history is needed
+        game = ThreesBitBoard()
+        game.history = None
+
+        if _spectate(screen, game, player, fps):
+            _tell_user(screen, "Game Over!")
+            wait = screen.getch()
 
-        _draw_board(screen, game.board)  # Draw the board
-        next_tile = game.nextTile
+        _tell_user(screen, "The highest tile was: " + str(game.highestTile))
+        wait = screen.getch()
+        return
 
-        if next_tile == 1:
-            color_pair = 1
-        elif next_tile == 2:
-            color_pair = 2
-        else:
-            color_pair = 3
+    game = ThreesBoard()  # Make a new board
+    drawn = None  # Board on the screen, only changed cells are drawn
 
-        if isinstance(next_tile, list):
-            tiles = [str(t) for t in next_tile]
-            _tell_user(screen, "    ".join(tiles), color_pair)
+    # Game Loop
+    while not game.gameOver():
 
-        else:
-            _tell_user(screen, str(next_tile), color_pair)
+        drawn = _draw_board(screen, game.board, drawn)  # Draw the board
+        _tell_next_tile(screen, game.nextTile)
 
         while 1:
 
@@ -300,7 +320,7 @@ def main(screen):
 
         # Game Over
         _tell_user(screen, "Game Over!")
-        _draw_board(screen, game.board)
+        _draw_board(screen, game.board, drawn)
         wait = screen.getch()
 
     _tell_user(screen, "Your highest tile was: " + str(game.highestTile))
@@ -310,7 +330,23 @@ def main(screen):
 
 if __name__ == '__main__':
 
+    # python ThreesGame.py [--watch STRATEGY] [--fps FPS]
+    parser = argparse.ArgumentParser(description='Threes! on the command line')
+    parser.add_argument('--watch', metavar='STRATEGY',
+                        help='watch a strategy play, named as in ThreesRunner')
+    parser.add_argument('--fps', type=float, default=30,
+                        help='frames a second when watching, 0 for every move')
+    parser.add_argument('--seed', type=int, help='seed of the strategy')
+    args = parser.parse_args()
+
+    player = None
+    if args.watch:
+        from ThreesRunner import _load_strategy
+        player = _load_strategy(args.watch, args.seed,
+                                {'rollouts': 100, 'depth': 2, 'deadline': 100,
+                                 'scoring': 'moves'})
+
     try:
-        curses.wrapper(main)
+        curses.wrapper(main, player, args.fps)
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" Play many games of Threes! with a strategy, without a screen
+
+    python ThreesRunner.py random -n 10000 -o random.jsonl
+    python ThreesRunner.py mc -n 200 -o mc.csv --rollouts 50
+    python ThreesRunner.py mymodule:choose -n 100 -o mine.jsonl
+
+A strategy is random, mc (MonteCarloPlayer), expectimax
+(ExpectimaxPlayer), mcts (MCTSPlayer), or module:name, where name is a
+choose(game) function, a Strategy, or a Strategy class (see
+ThreesStrategy).
+
+Games are played across a process pool, and one line is written for
+every game, in order, as soon as it and the games before it are done:
+the game number, its seed, the highest tile, the number of moves and
+the score. Game i always gets the same seed for
+the same --seed, so an interrupted run can be finished with --resume.
+"""
+
+
+###########
+# Imports #
+###########
+
+from __future__ import print_function
+
+
+import argparse
+import csv
+import importlib
+import json
+import os
+import sys
+import time
+
+
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+
+from ThreesBoard import _get_score
+from ThreesStrategy import RandomStrategy, as_strategy
+from ThreesBitBoard import ThreesBitBoard, init_tables
+from TileDeck import _derive_seed
+
+
+#######################
+# Important Constants #
+#######################
+
+
+FIELDS = ('game', 'seed', 'highest', 'moves', 'score')
+
+# Games handed to the pool ahead of the one being waited for, per worker
+_AHEAD = 8
+
+# Seeds derived from a game's seed for other uses are numbered from here,
+# far past any number of forks, so they are never the seed of a fork
+_STRATEGY_SEED = 1 << 62
+
+
+####################
+# Helper Functions #
+####################
+
+
+def _strategy_seed(seed):
+    """Seed of the strategy playing the game seeded with seed"""
+
+    return _derive_seed(seed, _STRATEGY_SEED)
+
+
+def _random_strategy(seed, options):
+    return RandomStrategy()
+
+
+def _mc_strategy(seed, options):
+    from Expectimax_AI import MonteCarloPlayer
+    return MonteCarloPlayer(options['rollouts'], seed=seed,
+                            scoring=options['scoring'])
+
+
+def _expectimax_strategy(seed, options):
+    from Expectimax_AI import ExpectimaxPlayer
+    return ExpectimaxPlayer(options['depth'])
+
+
+def _mcts_strategy(seed, options):
+    from Expectimax_AI import MCTSPlayer
+    return MCTSPlayer(options['deadline'], seed=seed)
+
+
+STRATEGIES = {'random': _random_strategy,
+              'mc': _mc_strategy,
+              'expectimax': _expectimax_strategy,
+              'mcts': _mcts_strategy}
+
+
+def _load_strategy(name, seed, options):
+    """The strategy called name, see ThreesStrategy"""
+
+    if name in STRATEGIES:
+        return STRATEGIES[name](seed, options)
+
+    module, _, function = name.partition(':')
+
+    if not function:
+        raise ValueError('unknown strategy ' + repr(name) +
+                         ', expected one of ' +
+                         ', '.join(sorted(STRATEGIES)) +
+                         ' or module:name')
+
+    return as_strategy(getattr(importlib.import_module(module), function))
+
+
+def play(game, strategy, index=0):
+    """Play game to the end with strategy, and return the result as a dict
+
+    The strategy is closed afterwards.
+    """
+
+    try:
+        while not game.gameOver():
+            game.swipe(strategy.choose(game))
+    finally:
+        strategy.close()
+
+    return {'game': index,
+            'seed': game.seed,
+            'highest': game.highestTile,
+            'moves': game.moveCount,
+            'score': _get_score(game.board)}
+
+
+def play_game(task):
+    """Play one new game, and return its result as a dict
+
+    task: (game number, seed, strategy name, options)
+    """
+
+    index, seed, name, options = task
+
+    game = ThreesBitBoard(seed=seed)
+    game.history = None
+
+    return play(game, _load_strategy(name, _strategy_seed(seed), options),
+                index)
+
+
+def _finished(path, fmt, stats=None):
+    """Game numbers already in the output file
+
+    A line cut short by an interruption is removed from the file. The
+    results in it are added to stats, if given.
+    """
+
+    done = set()
+
+    if not os.path.exists(path):
+        return done
+
+    end = 0
+
+    with open(path, 'rb+') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+
+            text = line.decode('utf-8').strip()
+
+            result = None
+
+            if fmt == 'csv':
+                row = text.split(',')
+                if row[0].isdigit():
+                    result = dict(zip(FIELDS, (int(value) for value in row)))
+            elif text:
+                result = json.loads(text)
+
+            if result is not None:
+                done.add(result['game'])
+                if stats is not None:
+                    stats.add(result)
+
+            end += len(line)
+
+        f.truncate(end)
+
+    return done
+
+
+class Stats(object):
+    """Running totals of the results, kept in constant memory"""
+
+    def __init__(self):
+        self.games = 0
+        self.resumed = 0
+        self.moves = 0
+        self.score = 0
+        self.best_score = 0
+        self.highest = {}
+
+    def add(self, result):
+        self.games += 1
+        self.moves += result['moves']
+        self.score += result['score']
+        self.best_score = max(self.best_score, result['score'])
+        self.highest[result['highest']] = (
+            self.highest.get(result['highest'], 0) + 1)
+
+    def report(self, elapsed, out=sys.stderr):
+        if not self.games:
+            print('No games played.', file=out)
+            return
+
+        if self.resumed:
+            print('\n  Games played: ' + str(self.games) + ', ' +
+                  str(self.resumed) + ' before --resume and ' +
+                  str(self.games - self.resumed) +
+                  ' in {:.1f} seconds'.format(elapsed), file=out)
+        else:
+            print('\n  Games played: ' + str(self.games) +
+                  ' in {:.1f} seconds'.format(elapsed), file=out)
+        print('  Mean moves:   {:.1f}'.format(self.moves / float(self.games)),
+              file=out)
+        print('  Mean score:   {:.1f}'.format(self.score / float(self.games)),
+              file=out)
+        print('  Best score:   ' + str(self.best_score), file=out)
+        print('  Highest tiles:', file=out)
+
+        for tile in sorted(self.highest):
+            count = self.highest[tile]
+            print('    {:6d} {:8d} {:6.1%}'.format(
+                tile, count, count / float(self.games)), file=out)
+
+
+def _open_output(path, mode, fmt):
+    """Open the results file, letting csv write its own line endings"""
+
+    if fmt != 'csv':
+        return open(path, mode)
+    if sys.version_info[0] < 3:
+        return open(path, mode + 'b')
+    return open(path, mode, newline='')
+
+
+def run(strategy, games, seed=0, workers=None, out=sys.stdout, fmt='jsonl',
+        skip=(), options=None, stats=None):
+    """Play games with strategy, writing each result to out
+
+    Results are written in game order. Only a few games per worker are
+    queued at a time, so memory does not grow with the number of games.
+    Games in skip are not played.
+
+    Returns the Stats of the games played.
+    """
+
+    options = options or {}
+    stats = stats or Stats()
+    workers = workers or cpu_count()
+
+    writer = csv.DictWriter(out, FIELDS) if fmt == 'csv' else None
+    tasks = ((i, _derive_seed(seed, i), strategy, options)
+             for i in range(games) if i not in skip)
+
+    def write(result):
+        if writer:
+            writer.writerow(result)
+        else:
+            out.write(json.dumps(result, sort_keys=True) + '\n')
+        out.flush()
+        stats.add(result)
+
+    if workers == 1:
+        for task in tasks:
+            write(play_game(task))
+        return stats
+
+    pool = Pool(workers, init_tables)
+
+    try:
+        pending = deque()
+
+        for task in tasks:
+            pending.append(pool.apply_async(play_game, (task,)))
+
+            if len(pending) >= workers * _AHEAD:
+                write(pending.popleft().get())
+
+        while pending:
+            write(pending.popleft().get())
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return stats
+
+
+#################
+# Main Function #
+#################
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0].strip())
+    parser.add_argument('strategy',
+                        help='random, mc, expectimax, mcts or module:name')
+    parser.add_argument('-n', '--games', type=int, default=100)
+    parser.add_argument('-o', '--output',
+                        help='results file, .csv for CSV, else JSON lines')
+    parser.add_argument('--format', choices=('jsonl', 'csv'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-j', '--workers', type=int, default=cpu_count())
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the games already in the output file')
+    parser.add_argument('--rollouts', type=int, default=100,
+                        help='rollouts per move for mc')
+    parser.add_argument('--depth', type=int, default=2,
+                        help='search depth for expectimax')
+    parser.add_argument('--deadline', type=float, default=100,
+                        help='milliseconds per move for mcts')
+    parser.add_argument('--scoring', default='moves',
+                        help='rollout scoring for mc, see '
+                             'Expectimax_AI.SCORINGS')
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if fmt is None:
+        csv_output = args.output and args.output.endswith('.csv')
+        fmt = 'csv' if csv_output else 'jsonl'
+
+    if args.resume and not args.output:
+        parser.error('--resume needs --output')
+
+    options = {'rollouts': args.rollouts, 'depth': args.depth,
+               'deadline': args.deadline, 'scoring': args.scoring}
+    stats = Stats()
+    skip = set()
+
+    if args.resume:
+        skip = _finished(args.output, fmt, stats)
+        stats.resumed = stats.games
+
+    # Check the strategy before starting any workers
+    _load_strategy(args.strategy, 0, options).close()
+
+    start = time.time()
+
+    if args.output:
+        out = _open_output(args.output, 'a' if args.resume else 'w', fmt)
+    else:
+        out = sys.stdout
+
+    try:
+        if fmt == 'csv' and not (args.output and os.path.getsize(args.output)):
+            csv.DictWriter(out, FIELDS).writeheader()
+
+        run(args.strategy, args.games, args.seed, args.workers, out, fmt,
+            skip, options, stats)
+
+    except KeyboardInterrupt:
+        print('\n  Interrupted, finish with --resume.', file=sys.stderr)
+        return 1
+
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    stats.report(time.time() - start)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" Threes Stats
+
+Counters and timers for the hot paths of ThreesBoard and TileDeck. They
+are off by default, and then cost one check of the enabled flag.
+
+    import ThreesStats
+
+    with ThreesStats.collect() as stats:
+        player.choose(game)
+
+    print(stats.snapshot())
+
+What is counted, by key of the snapshot:
+
+left, right, up, down - swipes in each direction, legal or not
+noop                  - swipes that did not change the board
+deepcopy              - copy.deepcopy calls made by the list board
+regenerate            - new decks made by TileDeck.get_next_tile
+legality              - seconds spent finding the legal moves
+move                  - seconds spent applying swipes
+playout               - seconds spent in playout
+
+A playout's swipes are counted by direction once it ends. Its legality
+checks and swipes are not timed one by one, so their time is all in
+playout, and none of it in legality or move.
+"""
+
+
+###########
+# Imports #
+###########
+
+# Future imports must occur at the beginning of a file
+from __future__ import print_function
+
+
+import time
+
+
+#######################
+# Important Constants #
+#######################
+
+
+KEYS = ('left', 'right', 'up', 'down', 'noop', 'deepcopy', 'regenerate',
+        'legality', 'move', 'playout')
+
+# Keys of the swipes, in the same order as ThreesBoard.MOVES
+_MOVE_KEYS = KEYS[:4]
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Checked by the instrumented code before doing anything else
+enabled = False
+
+_counts = dict.fromkeys(KEYS, 0)
+_counts['legality'] = _counts['move'] = _counts['playout'] = 0.0
+
+
+####################
+# Helper Functions #
+####################
+
+
+def enable():
+    """Start counting"""
+
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Stop counting, the counts are kept"""
+
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Set every count back to 0"""
+
+    for key in KEYS:
+        _counts[key] = 0
+    _counts['legality'] = _counts['move'] = _counts['playout'] = 0.0
+
+
+def snapshot():
+    """The counts so far, as a new dict"""
+
+    return dict(_counts)
+
+
+def count(key):
+    """Add one to a counter"""
+
+    _counts[key] += 1
+
+
+def record_swipe(move, changed, start):
+    """Count a swipe that started at timer() == start"""
+
+    _counts['move'] += timer() - start
+    _counts[move] += 1
+
+    if not changed:
+        _counts['noop'] += 1
+
+
+def record_playout(made, start):
+    """Count the swipes of a playout that started at timer() == start
+
+    made: swipes made in each direction, in the order of ThreesBoard.MOVES
+    """
+
+    _counts['playout'] += timer() - start
+
+    for key, n in zip(_MOVE_KEYS, made):
+        _counts[key] += n
+
+
+def timed_move_mask(game):
+    """game.get_move_mask(), adding its time to legality"""
+
+    start = timer()
+    mask = game.get_move_mask()
+    _counts['legality'] += timer() - start
+    return mask
+
+
+###################
+# Collector Class #
+###################
+
+
+class Collector(object):
+    """Counts made inside one with block
+
+    Counting is turned on for the block, and back off after it if it was
+    off before. Collectors can be nested.
+    """
+
+    def __init__(self):
+        self._was_enabled = False
+        self._start = None
+        self._end = None
+
+    def __enter__(self):
+        self._was_enabled = enabled
+        self._start = snapshot()
+        self._end = None
+        enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._end = snapshot()
+        if not self._was_enabled:
+            disable()
+
+    def snapshot(self):
+        """The counts made in the block, or so far if still inside it"""
+
+        end = self._end if self._end is not None else snapshot()
+        return dict((key, end[key] - self._start[key]) for key in KEYS)
+
+
+def collect():
+    """Collector for a with block, see above"""
+
+    return Collector()
@@ -0,0 +1,99 @@
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" Threes Strategy
+
+A strategy is anything with a choose(game) method, that takes a
+ThreesBoard and returns one of game.get_valid_moves(). Players only need
+to follow it, but subclassing Strategy also gives them close() and the
+with statement.
+"""
+
+
+###########
+# Imports #
+###########
+
+# Future imports must occur at the beginning of a file
+from __future__ import print_function
+
+
+##################
+# Strategy Class #
+##################
+
+
+class Strategy(object):
+    """Base class of the players"""
+
+    def choose(self, game):
+        """Move to make in game, one of game.get_valid_moves()"""
+
+        raise NotImplementedError
+
+    def close(self):
+        """Free anything the strategy holds on to, like worker processes"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RandomStrategy(Strategy):
+    """Pick any valid move, with the same chance for each
+
+    rng: random.Random to pick with, the game's own rng if None
+    """
+
+    def __init__(self, rng=None):
+        self.rng = rng
+
+    def choose(self, game):
+        moves = game.get_valid_moves()
+        rng = self.rng if self.rng is not None else game.rng
+        return moves[rng.randint(0, len(moves) - 1)]
+
+
+class FunctionStrategy(Strategy):
+    """Strategy of a plain choose(game) function"""
+
+    def __init__(self, function):
+        self.function = function
+
+    def choose(self, game):
+        return self.function(game)
+
+
+####################
+# Helper Functions #
+####################
+
+
+def as_strategy(player):
+    """player as a Strategy
+
+    player: a Strategy, an object with a choose method, a Strategy class
+            that takes no arguments, or a choose(game) function
+    """
+
+    if isinstance(player, type):
+        player = player()
+
+    if isinstance(player, Strategy):
+        return player
+
+    if hasattr(player, 'choose'):
+        return FunctionStrategy(player.choose)
+
+    if callable(player):
+        return FunctionStrategy(player)
+
+    raise TypeError(repr(player) + ' is not a strategy')
@@ -0,0 +1,173 @@
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" Threes Symmetry
+
+A 4x4 game of Threes! plays the same after any of the 8 reflections and
+rotations of the board, as long as the moves are turned with it:
+mirroring the board left to right turns a swipe left into a swipe
+right. This finds the same representative, the canonical board, for all
+8 versions of a packed board, so that searches and caches can treat
+them as one, and turns one training sample into 8.
+
+Transform k is made of three steps, done in this order when their bit
+of k is set:
+
+1 - mirror left to right, like ThreesBoard._reverse
+2 - flip top to bottom
+4 - transpose, like ThreesBoard._row2col
+"""
+
+
+###########
+# Imports #
+###########
+
+# Future imports must occur at the beginning of a file
+from __future__ import print_function
+
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+from ThreesBitBoard import _transpose
+
+
+#######################
+# Important Constants #
+#######################
+
+
+TRANSFORMS = 8
+
+# Move maps of each step, as indices into ThreesBoard.MOVES
+_MIRROR_MOVES = (1, 0, 2, 3)
+_FLIP_MOVES = (0, 1, 3, 2)
+_TRANSPOSE_MOVES = (2, 3, 0, 1)
+
+
+####################
+# Helper Functions #
+####################
+
+
+def _mirror(word):
+    """Mirror the packed board left to right, the packed _reverse"""
+
+    return ((word & 0x000F000F000F000F) << 12 |
+            (word & 0x00F000F000F000F0) << 4 |
+            (word & 0x0F000F000F000F00) >> 4 |
+            (word & 0xF000F000F000F000) >> 12)
+
+
+def _flip(word):
+    """Flip the packed board top to bottom"""
+
+    return ((word & 0xFFFF) << 48 |
+            (word & 0xFFFF0000) << 16 |
+            (word >> 16) & 0xFFFF0000 |
+            word >> 48)
+
+
+def transform(word, k):
+    """Packed board after transform k"""
+
+    if k & 1:
+        word = _mirror(word)
+    if k & 2:
+        word = _flip(word)
+    if k & 4:
+        word = _transpose(word)
+    return word
+
+
+def _move_map(k):
+    """Move on the transformed board for each move on the board"""
+
+    moves = list(range(4))
+    for bit, step in ((1, _MIRROR_MOVES), (2, _FLIP_MOVES),
+                      (4, _TRANSPOSE_MOVES)):
+        if k & bit:
+            moves = [step[move] for move in moves]
+    return tuple(moves)
+
+
+# MOVE_MAPS[k][move] is where move goes on a board after transform k, and
+# INVERSE_MOVES[k] takes a move on the transformed board back
+MOVE_MAPS = tuple(_move_map(k) for k in range(TRANSFORMS))
+INVERSE_MOVES = tuple(tuple(moves.index(move) for move in range(4))
+                      for moves in MOVE_MAPS)
+
+# Transform that undoes each transform
+_CELLS = sum(cell << (4 * cell) for cell in range(16))
+INVERSE = tuple(next(j for j in range(TRANSFORMS)
+                     if transform(transform(_CELLS, k), j) == _CELLS)
+                for k in range(TRANSFORMS))
+
+# _PERMUTATIONS[k][i] is the cell of the board that transform k puts in
+# cell i
+_PERMUTATIONS = tuple(tuple((transform(_CELLS, k) >> (4 * i)) & 15
+                            for i in range(16))
+                      for k in range(TRANSFORMS))
+
+# _MASK_MAPS[k][mask] is a move mask after transform k
+_MASK_MAPS = tuple(tuple(sum(1 << moves[move] for move in range(4)
+                             if (mask >> move) & 1)
+                         for mask in range(16))
+                   for moves in MOVE_MAPS)
+
+
+def canonical(word):
+    """The canonical packed board, the smallest of the 8 transforms
+
+    Returns (canonical board, k, INVERSE_MOVES[k]), so that the move
+    picked on the canonical board is INVERSE_MOVES[k][move] on word.
+    """
+
+    mirrored = _mirror(word)
+    flipped = _flip(word)
+    turned = _flip(mirrored)
+
+    boards = (word, mirrored, flipped, turned,
+              _transpose(word), _transpose(mirrored),
+              _transpose(flipped), _transpose(turned))
+
+    best = min(boards)
+    k = boards.index(best)
+    return best, k, INVERSE_MOVES[k]
+
+
+def augment(words, moves=None, masks=None):
+    """Every board of an array under all 8 transforms, with numpy
+
+    words: packed boards
+    moves, masks: optional moves and legal move masks to transform too
+
+    Returns arrays of 8 * N, transform by transform: the first N are the
+    boards unchanged, then the N after transform 1, and so on. Moves and
+    masks come back in the same order, or None if not given.
+    """
+
+    words = np.asarray(words, dtype=np.uint64)
+    shifts = np.arange(0, 64, 4, dtype=np.uint64)
+    cells = (words[:, None] >> shifts) & np.uint64(15)
+    permutations = np.array(_PERMUTATIONS)
+
+    boards = np.bitwise_or.reduce(
+        cells[:, permutations].transpose(1, 0, 2) << shifts, axis=2)
+
+    if moves is not None:
+        moves = np.array(MOVE_MAPS)[:, np.asarray(moves)].ravel()
+    if masks is not None:
+        masks = np.array(_MASK_MAPS)[:, np.asarray(masks)].ravel()
+
+    return boards.ravel(), moves, masks
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+########################################################################
+# Threes! is a game by by Asher Vollmer, Greg Wohlwend, Jimmy Hinson,  #
+# and Hidden Variable. This is created so that AI/ML strategies for    #
+# the game can be developed and tested easier, and is not intended as  #
+# a replacement of the original game. Please support the developers by #
+# purchasing their excellent game!                                     #
+########################################################################
+
+
+""" Play two strategies against each other on the same deals
+
+    python ThreesTournament.py random mc --metric moves
+    python ThreesTournament.py mc mymodule:Player --max-games 2000
+
+Strategies are named as in ThreesRunner. Both strategies play game i
+with the same seed, so they start from the same board, and the decks
+after it come out the same no matter which moves are made. The
+difference in moves or score is then compared game by game.
+
+Games are played a batch at a time, and after each batch a paired test
+checks whether the difference in means is significant. The tournament
+stops at the first batch where it is, once MIN_GAMES deals have been
+played, or at --max-games. Every batch
+is tested at alpha divided by the number of batches that may be played,
+so stopping early does not make a false winner more likely than alpha.
+"""
+
+
+###########
+# Imports #
+###########
+
+from __future__ import print_function
+
+
+import argparse
+import math
+import random
+import sys
+
+
+from multiprocessing import Pool, cpu_count
+
+
+from ThreesBitBoard import ThreesBitBoard, init_tables
+from ThreesRunner import play, _load_strategy, _strategy_seed
+from ThreesRunner import _STRATEGY_SEED
+from TileDeck import _derive_seed
+
+
+#######################
+# Important Constants #
+#######################
+
+
+METRICS = ('moves', 'score')
+
+# Games played before a winner can be called, so that the normal
+# approximation of _p_value holds
+MIN_GAMES = 30
+
+# Seed of the deck of a deal, apart from the strategy's and the forks'
+_DECK_SEED = _STRATEGY_SEED + 1
+
+
+####################
+# Helper Functions #
+####################
+
+
+def deal(seed):
+    """A new game whose decks do not depend on the moves made in it
+
+    The deck gets its own rng, so two strategies playing the same seed
+    draw the same tiles, apart from bonus tiles, which depend on the
+    highest tile.
+    """
+
+    game = ThreesBitBoard(seed=seed)
+    game.history = None
+    game.deck.rng = random.Random(_derive_seed(seed, _DECK_SEED))
+    return game
+
+
+def _play_deal(task):
+    """Play one deal, see ThreesRunner.play_game for task"""
+
+    index, seed, name, options = task
+    strategy = _load_strategy(name, _strategy_seed(seed), options)
+    return play(deal(seed), strategy, index)
+
+
+def _p_value(n, total, squares):
+    """Two sided p-value that the mean of n differences is not 0
+
+    total and squares are the sum of the differences and of their
+    squares. Uses the normal approximation to the paired t-test. With no
+    variance there is nothing to test against, so the result is 1.
+    """
+
+    if n < 2:
+        return 1.0
+
+    mean = total / float(n)
+    variance = (squares - n * mean * mean) / (n - 1)
+
+    if variance <= 0:
+        return 1.0
+
+    z = mean / math.sqrt(variance / n)
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def tournament(a, b, metric='moves', alpha=0.05, batch=50, max_games=1000,
+               seed=0, workers=1, options=None, report=None, options_b=None):
+    """Play strategies a and b on the same deals until one is better
+
+    a, b: strategy names, see ThreesRunner
+    metric: 'moves' or 'score', the result that is compared
+    batch: deals played between tests, min 2
+    max_games: deals played at most, by each strategy
+    options: strategy options, see ThreesRunner
+    report: called with the results so far after every batch
+    options_b: options for b, if not the same as a's, e.g. to play mc
+               against mc with another scoring
+
+    Returns a dict of the results: games played, the mean metric of each
+    strategy, their difference a - b, its p-value, and winner, which is
+    a, b, or None if neither was significantly better.
+    """
+
+    if metric not in METRICS:
+        raise ValueError('metric must be one of ' + ', '.join(METRICS))
+
+    options = options or {}
+    options_b = options_b or options
+    batch = max(2, batch)
+    looks = -(-max_games // batch)
+    level = alpha / looks
+
+    pool = Pool(workers, init_tables) if workers > 1 else None
+    play_all = pool.map if pool else lambda f, tasks: list(map(f, tasks))
+
+    n = 0
+    sums = [0, 0]
+    total = squares = 0
+    result = None
+
+    try:
+        while n < max_games:
+            games = range(n, min(n + batch, max_games))
+            tasks = [(i, _derive_seed(seed, i), name, opts)
+                     for i in games
+                     for name, opts in ((a, options), (b, options_b))]
+            results = play_all(_play_deal, tasks)
+
+            for first, second in zip(results[::2], results[1::2]):
+                diff = first[metric] - second[metric]
+                sums[0] += first[metric]
+                sums[1] += second[metric]
+                total += diff
+                squares += diff * diff
+
+            n += len(games)
+            p = _p_value(n, total, squares)
+
+            winner = None
+            if n >= MIN_GAMES and p < level:
+                winner = a if total > 0 else b
+
+            result = {'games': n,
+                      'metric': metric,
+                      'mean_a': sums[0] / float(n),
+                      'mean_b': sums[1] / float(n),
+                      'difference': total / float(n),
+                      'p': p,
+                      'level': level,
+                      'winner': winner}
+
+            if report:
+                report(result)
+
+            if winner is not None:
+                break
+
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    return result
+
+
+#################
+# Main Function #
+#################
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0].strip())
+    parser.add_argument('a', help='first strategy')
+    parser.add_argument('b', help='second strategy')
+    parser.add_argument('--metric', choices=METRICS, default='moves')
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--max-games', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-j', '--workers', type=int, default=cpu_count())
+    parser.add_argument('--rollouts', type=int, default=100,
+                        help='rollouts per move for mc')
+    parser.add_argument('--depth', type=int, default=2,
+                        help='search depth for expectimax')
+    parser.add_argument('--deadline', type=float, default=100,
+                        help='milliseconds per move for mcts')
+    parser.add_argument('--scoring', nargs='+', default=['moves'],
+                        metavar='SCORING',
+                        help='rollout scoring for mc, see '
+                             'Expectimax_AI.SCORINGS; a second one is for b')
+    args = parser.parse_args(argv)
+
+    if len(args.scoring) > 2:
+        parser.error('--scoring takes one or two names')
+
+    scorings = (args.scoring[0], args.scoring[-1])
+    options = [{'rollouts': args.rollouts, 'depth': args.depth,
+                'deadline': args.deadline, 'scoring': scoring}
+               for scoring in scorings]
+
+    names = (args.a, args.b)
+    if args.a == args.b:
+        names = tuple(name + ' (' + scoring + ')'
+                      for name, scoring in zip(names, scorings))
+
+    def report(result):
+        print('  {games:6d} games  {mean_a:10.1f} vs {mean_b:10.1f}'
+              '  p = {p:.4f}'.format(**result), file=sys.stderr)
+
+    result = tournament(args.a, args.b, args.metric, args.alpha, args.batch,
+                        args.max_games, args.seed, args.workers, options[0],
+                        report, options[1])
+
+    if result['winner'] is None:
+        print('\n  No significant difference in ' + args.metric +
+              ' after ' + str(result['games']) + ' games.')
+    else:
+        winner = names[0] if result['difference'] > 0 else names[1]
+        print('\n  ' + winner + ' wins on ' + args.metric +
+              ' after ' + str(result['games']) + ' games, by ' +
+              '{:.1f}'.format(abs(result['difference'])) + ' on average.')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
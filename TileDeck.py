@@ -24,6 +24,9 @@ from __future__ import print_function
 import random
 
 
+import ThreesStats
+
+
 ######################
 # Important Constant #
 ######################
@@ -44,10 +47,39 @@ a copy of the list and then draw in order. Another is to pop off a
 random tile.
 """
 
+"""
+Rank of a tile is its index in _TILES. 0 is the empty space, 1 and 2 are
+themselves, and every tile after 3 is double the one before it. Ranks fit
+in 4 bits, so 12288 is the largest tile that can be stored.
+"""
+
+_TILES = (0, 1, 2, 3, 6, 12, 24, 48, 96, 192, 384, 768, 1536, 3072, 6144,
+          12288)
+
+_RANKS = dict((tile, rank) for rank, tile in enumerate(_TILES))
+
 ####################
 # Helper Functions #
 ####################
 
+def _tile_code(tile):
+    """5 bit code of a next tile
+
+    A plain tile is its rank. A bonus deck is 16 plus the rank of its
+    largest tile, which is enough to create it again.
+    """
+
+    if isinstance(tile, list):
+        return 16 | _RANKS[tile[0]]
+    return _RANKS[tile]
+
+def _code_tile(code):
+    """The next tile of a code from _tile_code"""
+
+    if code & 16:
+        return _create_bonus_deck(_TILES[code & 15] * 8)
+    return _TILES[code]
+
 def _create_bonus_deck(highest_tile=3):
     """Bonus Deck for game of Threes!
 
@@ -72,11 +104,12 @@ def _create_bonus_deck(highest_tile=3):
 
     return bonus_deck
 
-def _create_deck(highest_tile=3):
+def _create_deck(highest_tile=3, rng=random):
     """Tiles to come in a game of Threes.
 
     The standard deck are two base decks that are shuffled and then
     combined
+    rng - random.Random to shuffle with, or the random module itself
     """
     deck = []
     bonus_deck = _create_bonus_deck(highest_tile)
@@ -88,14 +121,112 @@ def _create_deck(highest_tile=3):
     sequence1 = list(_BASE)
     sequence2 = list(_BASE)
 
-    random.shuffle(sequence1)
-    random.shuffle(sequence2)
+    rng.shuffle(sequence1)
+    rng.shuffle(sequence2)
 
     # original deck can be [] or contain a bonus tile
     deck += sequence1 + sequence2
 
     return deck
 
+def _get_state(deck):
+    """Compact state of a deck list, see TileDeck.state"""
+
+    bonus = 0
+    if deck and isinstance(deck[0], list):
+        bonus = deck[0][0]
+        deck = deck[1:]
+
+    rest = 1 if len(deck) > len(_BASE) else 0
+    current = deck[:len(deck) - len(_BASE)] if rest else deck
+
+    return (bonus, current.count(1), current.count(2), current.count(3), rest)
+
+# State of a deck with no tiles left, the next draw creates a new deck
+_EMPTY_STATE = (0, 0, 0, 0, 0)
+
+# Memoized results of _get_draws and TileDeck.distribution
+_DRAWS = {}
+_DISTRIBUTIONS = {}
+
+def _next_half(bonus, n1, n2, n3, rest):
+    """Deck state after a draw, moving on to the next half when needed"""
+
+    if n1 + n2 + n3 == 0 and rest:
+        return (bonus, 4, 4, 4, rest - 1)
+    return (bonus, n1, n2, n3, rest)
+
+def _get_draws(state, highest_tile=3):
+    """Every possible next tile, as a tuple of (chance, tile, next state)
+
+    state is a TileDeck.state(). highest_tile only matters when the deck
+    is empty; like get_next_tile, it decides the bonus deck of the new
+    deck. A bonus deck is drawn as a list, the same as get_next_tile.
+    """
+
+    if state == _EMPTY_STATE:
+        bonus_deck = _create_bonus_deck(highest_tile)
+        key = (state, bonus_deck[0] if bonus_deck else 0)
+    else:
+        key = (state, 0)
+
+    try:
+        return _DRAWS[key]
+    except KeyError:
+        pass
+
+    bonus, n1, n2, n3, rest = state
+
+    if bonus:
+        draws = ((1.0, _create_bonus_deck(bonus * 8),
+                  (0, n1, n2, n3, rest)),)
+
+    elif state == _EMPTY_STATE and key[1]:
+        # A new deck starts with its bonus tiles
+        draws = ((1.0, _create_bonus_deck(highest_tile), (0, 4, 4, 4, 1)),)
+
+    else:
+        if state == _EMPTY_STATE:
+            n1, n2, n3, rest = 4, 4, 4, 1
+
+        total = float(n1 + n2 + n3)
+        draws = []
+        if n1:
+            draws.append((n1 / total, 1, _next_half(0, n1 - 1, n2, n3, rest)))
+        if n2:
+            draws.append((n2 / total, 2, _next_half(0, n1, n2 - 1, n3, rest)))
+        if n3:
+            draws.append((n3 / total, 3, _next_half(0, n1, n2, n3 - 1, rest)))
+        draws = tuple(draws)
+
+    _DRAWS[key] = draws
+    return draws
+
+def _state_code(state):
+    """Pack a TileDeck.state() into 17 bits"""
+
+    bonus, n1, n2, n3, rest = state
+    return _RANKS[bonus] | n1 << 4 | n2 << 8 | n3 << 12 | rest << 16
+
+def _code_state(code):
+    """The TileDeck.state() of a code from _state_code"""
+
+    return (_TILES[code & 15], (code >> 4) & 15, (code >> 8) & 15,
+            (code >> 12) & 15, code >> 16)
+
+def _derive_seed(seed, n):
+    """Seed of the n-th fork of something seeded with seed
+
+    Mixed like splitmix64, so that nearby seeds and forks do not give
+    related random sequences.
+    """
+
+    mask = (1 << 64) - 1
+    z = (seed + (n + 1) * 0x9E3779B97F4A7C15) & mask
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & mask
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & mask
+    return z ^ (z >> 31)
+
 def _create_deck_2():
     """Tiles in a Threes! tile deck
 
@@ -110,21 +241,41 @@ def _create_deck_2():
 
 
 class TileDeck(object):
-    """Tile deck used in a game of Threes"""
+    """Tile deck used in a game of Threes
 
-    def __init__(self, existing_deck=None, highest_tile=3):
+    The tiles are kept in a tuple that is never changed, and drawing a
+    tile moves a cursor along it. Forked decks share the tuple.
+    """
+
+    def __init__(self, existing_deck=None, highest_tile=3, rng=None):
         """Generating a tile deck to be used in a game of threes
 
         highest_tile: depending on the highest score in game
         existing_deck: normally empty - starting a new game
                        if not empty - it means it's starting an previous
                                       game, and need the old deck again
+        rng: random.Random used to shuffle new decks, the random module
+             if None
         """
 
+        self.rng = rng if rng is not None else random
+
         if existing_deck:
             self.deck = existing_deck
         else:
-            self.deck = _create_deck(highest_tile)
+            self.deck = _create_deck(highest_tile, self.rng)
+
+    @property
+    def deck(self):
+        """The tiles left to draw, as a new list"""
+
+        return list(self._tiles[self._pos:])
+
+    @deck.setter
+    def deck(self, deck):
+        self._tiles = tuple(deck)
+        self._pos = 0
+        self._state = _get_state(deck)
 
     def get_next_tile(self, highest_tile=3):
         """Get the next tile in FIFO order due to bonus tile placement
@@ -132,13 +283,109 @@ class TileDeck(object):
         highest_tile: on the game board, the max bonus is 1/8 of it
         """
 
+        if self._pos == len(self._tiles):
+            # Make a draw a new deck if the old one runs out
+            self.deck = _create_deck(highest_tile, self.rng)
+
+            if ThreesStats.enabled:
+                ThreesStats.count('regenerate')
+
+        tile = self._tiles[self._pos]
+        self._pos += 1
+
+        bonus, n1, n2, n3, rest = self._state
+
+        if isinstance(tile, list):
+            bonus = 0
+        elif tile == 1:
+            n1 -= 1
+        elif tile == 2:
+            n2 -= 1
+        elif tile == 3:
+            n3 -= 1
+
+        if n1 + n2 + n3 == 0 and rest:
+            # Start counting the next half of the deck
+            self._state = _get_state(self._tiles[self._pos:])
+        else:
+            self._state = (bonus, n1, n2, n3, rest)
+
+        return tile
+
+    def state(self):
+        """What is left in the deck, as a tuple that can be a dict key
+
+        (bonus, n1, n2, n3, rest): bonus is the largest tile of a bonus
+        deck waiting to be drawn, 0 for none. n1, n2 and n3 are the 1, 2
+        and 3 tiles left in the shuffled half of _BASE being drawn from,
+        and rest is how many halves come after it.
+        """
+
+        return self._state
+
+    def distribution(self, highest_tile=3):
+        """Exact chances of the next tile, and of the tile after it
+
+        highest_tile: on the game board, used in case the deck runs out
+                      and a new one with bonus tiles is created. It is
+                      assumed to stay the same for both draws.
+
+        Returns two dicts from tile to chance. Bonus decks are keyed as a
+        tuple of their tiles, e.g. (24, 12, 6); the tile placed from one
+        is any of them with equal chance. Results are memoized on the
+        state of the deck, so this is cheap to call often; the dicts
+        returned are copies, free to change.
+        """
+
+        bonus_deck = _create_bonus_deck(highest_tile)
+        key = (self._state, bonus_deck[0] if bonus_deck else 0)
+
         try:
-            return self.deck.pop(0)
+            first, second = _DISTRIBUTIONS[key]
+            return dict(first), dict(second)
+        except KeyError:
+            pass
 
-        except IndexError:
-            # Make a draw a new deck if the old one runs out
-            self.deck = _create_deck(highest_tile)
-            return self.deck.pop(0)
+        first = {}
+        second = {}
+
+        for chance, tile, state in _get_draws(self._state, highest_tile):
+            tile_key = tuple(tile) if isinstance(tile, list) else tile
+            first[tile_key] = first.get(tile_key, 0.0) + chance
+
+            for chance2, tile2, _ in _get_draws(state, highest_tile):
+                tile_key = tuple(tile2) if isinstance(tile2, list) else tile2
+                second[tile_key] = second.get(tile_key, 0.0) + chance * chance2
+
+        _DISTRIBUTIONS[key] = first, second
+        return dict(first), dict(second)
+
+    def fork(self, rng=None):
+        """An independent copy of the deck, without copying any tiles
+
+        rng: random.Random for the copy to shuffle new decks with. The
+             copy shares this deck's if None.
+        """
+
+        deck = TileDeck.__new__(TileDeck)
+        deck._tiles = self._tiles
+        deck._pos = self._pos
+        deck._state = self._state
+        deck.rng = rng if rng is not None else self.rng
+        return deck
+
+    def __getstate__(self):
+        """The random module can't be pickled, so it is left out"""
+
+        state = self.__dict__.copy()
+        if state['rng'] is random:
+            state['rng'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.rng is None:
+            self.rng = random
 
     def __str__(self):
         """A peek at the deck"""
@@ -153,7 +400,7 @@ class TileDeck(object):
     def __eq__(self, other):
         """Check equality"""
 
-        return self.deck == other.deck
+        return self._tiles[self._pos:] == other._tiles[other._pos:]
 
 # Basic Testing
 if __name__ == '__main__':